@@ -1,32 +1,159 @@
 import os
+import functools
 import librosa
 import numpy as np
 import soundfile as sf
 import tensorflow_hub as hub
+from joblib import Parallel, delayed
+from threadpoolctl import threadpool_limits
+
+# Optional packages (best-effort)
+try:
+    import torch
+    import torchaudio
+    TORCHAUDIO_AVAILABLE = True
+except Exception:
+    TORCHAUDIO_AVAILABLE = False
+
+try:
+    import onnxruntime as ort
+    ONNXRUNTIME_AVAILABLE = True
+except Exception:
+    ONNXRUNTIME_AVAILABLE = False
+
+try:
+    from Acoustic.pitch_backend import PITCH_HOP, default_device, estimate_pitch
+except ImportError:  # run as a script from inside Acoustic/
+    from pitch_backend import PITCH_HOP, default_device, estimate_pitch
+
+# YAMNet is loaded lazily so forked dataset workers don't all pull in the
+# TF graph at import time; each process loads it once on first use.
+# The int8 ONNX model from export_yamnet_onnx.py is opt-in (YAMNET_USE_ONNX=1):
+# its embeddings differ slightly from the TF Hub model's, so the classifier
+# has to be retrained on them before it is used in production.
+YAMNET_URL = "https://tfhub.dev/google/yamnet/1"
+YAMNET_ONNX = os.path.join(os.path.dirname(os.path.abspath(__file__)), "yamnet_int8.onnx")
+USE_YAMNET_ONNX = os.environ.get("YAMNET_USE_ONNX") == "1"
+_yamnet = None
+
+# trailing dimension of each YAMNet output, in the hub model's return order
+_YAMNET_OUTPUT_DIMS = (521, 1024, 64)  # scores, embeddings, log-mel spectrogram
+
+
+def _load_onnx_yamnet(path):
+    """ONNX Runtime session wrapped to return (scores, embeddings, spectrogram) like the hub model."""
+    session = ort.InferenceSession(path, providers=ort.get_available_providers())
+    input_name = session.get_inputs()[0].name
+    # tf2onnx does not keep the signature's output order, so pick the outputs by their shape
+    by_dim = {out.shape[-1]: out.name for out in session.get_outputs()}
+    if any(dim not in by_dim for dim in _YAMNET_OUTPUT_DIMS):
+        raise ValueError(f"Unexpected YAMNet ONNX outputs in {path}: {session.get_outputs()}")
+    output_names = [by_dim[dim] for dim in _YAMNET_OUTPUT_DIMS]
+
+    def run(waveform):
+        return session.run(output_names, {input_name: waveform})
+
+    return run
+
+
+def get_yamnet():
+    global _yamnet
+    if _yamnet is None:
+        if USE_YAMNET_ONNX and ONNXRUNTIME_AVAILABLE and os.path.exists(YAMNET_ONNX):
+            _yamnet = _load_onnx_yamnet(YAMNET_ONNX)
+        else:
+            _yamnet = hub.load(YAMNET_URL)
+    return _yamnet
 
-# Load YAMNet
-yamnet = hub.load("https://tfhub.dev/google/yamnet/1")
 
 dataset_root = r"C:\Users\chint\OneDrive\Desktop\Audio dataset\segmented_5s"
 
-def extract_features(file_path):
-    y, sr = librosa.load(file_path, sr=16000)
+# every dataset worker that touches CUDA (torchcrepe pitch, torchaudio MFCC) opens its own
+# context on the one GPU, so the pool is capped to this many workers when CUDA is in use
+GPU_N_JOBS = 2
+
+# ---- Frame layout ----
+FRAME_HOP = 512             # librosa default hop for RMS / MFCC
+YAMNET_HOP = 7680           # 0.48 s patch hop at 16 kHz
+YAMNET_CENTRE = 7680        # patch k covers 0.96 s from k * YAMNET_HOP, so its centre is 0.48 s later
+
+
+def _frame_span(start, end, hop, n_frames, centre=0):
+    """
+    Frames whose centres fall inside samples [start, end) (at least one, clamped to n_frames).
+    centre: offset of frame k's centre from k * hop (0 for librosa's centred frames).
+    """
+    first = min(max(0, -(-(start - centre) // hop)), n_frames - 1)
+    return slice(first, max(first + 1, -(-(end - centre) // hop)))
+
+
+@functools.lru_cache(maxsize=None)
+def _torch_mfcc(sr, device):
+    # settings mirror librosa.feature.mfcc defaults so both paths give the same features
+    return torchaudio.transforms.MFCC(
+        sample_rate=sr,
+        n_mfcc=13,
+        melkwargs={
+            "n_fft": 2048,
+            "hop_length": FRAME_HOP,
+            "n_mels": 128,
+            "mel_scale": "slaney",
+            "norm": "slaney",
+            "pad_mode": "constant",
+        },
+    ).to(device)
+
 
+def compute_mfcc(y, sr=16000):
+    """(13, frames) MFCC matrix: torchaudio on GPU when available, else librosa on CPU."""
+    if TORCHAUDIO_AVAILABLE and torch.cuda.is_available():
+        waveform = torch.from_numpy(np.ascontiguousarray(y, dtype=np.float32)).to("cuda")
+        return _torch_mfcc(sr, "cuda")(waveform).cpu().numpy()
+    return librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13, hop_length=FRAME_HOP)
+
+
+def frame_features(y, sr=16000):
+    """
+    Frame-level features over the whole waveform, computed once so that any
+    number of windows can be aggregated from them without re-running STFTs,
+    pitch tracking or YAMNet per window.
+    """
+    f0, voiced = estimate_pitch(y, sr)
+    scores, embeddings, spectrogram = get_yamnet()(y.astype(np.float32))
+    return {
+        "rms": librosa.feature.rms(y=y, hop_length=FRAME_HOP)[0],
+        "mfcc": compute_mfcc(y, sr),
+        "pitch": np.where(voiced, f0, 0.0),
+        "voiced": voiced,
+        "yamnet": np.asarray(embeddings),
+    }
+
+
+def window_view(frames, start, end):
+    """Slice frame_features output down to samples [start, end) (views, no copies)."""
+    fs = _frame_span(start, end, FRAME_HOP, len(frames["rms"]))
+    ps = _frame_span(start, end, PITCH_HOP, len(frames["pitch"]))
+    ys = _frame_span(start, end, YAMNET_HOP, len(frames["yamnet"]), centre=YAMNET_CENTRE)
+    return {
+        "rms": frames["rms"][fs],
+        "mfcc": frames["mfcc"][:, fs],
+        "pitch": frames["pitch"][ps],
+        "voiced": frames["voiced"][ps],
+        "yamnet": frames["yamnet"][ys],
+    }
+
+
+def window_features(view):
+    """Feature vector for one window_view (or the full frame_features dict)."""
     # ---- Prosody ----
-    rms = librosa.feature.rms(y=y)[0]
-    pitch, _, _ = librosa.pyin(y, fmin=80, fmax=300)
-    pitch = np.nan_to_num(pitch)
-    energy_std = np.std(rms)
-    pitch_std = np.std(pitch)
+    energy_std = np.std(view["rms"])
+    pitch_std = np.std(view["pitch"])
 
     # ---- MFCC ----
-    mfcc = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
-    mfcc_mean = np.mean(mfcc, axis=1)
+    mfcc_mean = np.mean(view["mfcc"], axis=1)
 
     # ---- YAMNet Embedding (emotion/tone) ----
-    waveform = y.astype(np.float32)
-    scores, embeddings, spectrogram = yamnet(waveform)
-    yamnet_embedding = np.mean(embeddings, axis=0)
+    yamnet_embedding = np.mean(view["yamnet"], axis=0)
 
     # Combine into one feature vector
     return np.concatenate([
@@ -35,21 +162,51 @@ def extract_features(file_path):
         yamnet_embedding
     ])
 
+
+def extract_features(y, sr=16000):
+    """Feature vector for an in-memory 16 kHz waveform."""
+    return window_features(frame_features(y, sr))
+
+
+def extract_features_from_path(file_path):
+    y, sr = librosa.load(file_path, sr=16000)
+    return extract_features(y, sr)
+
+
+def _process(file_path, label):
+    # one BLAS thread per worker, otherwise librosa's BLAS calls oversubscribe the cores
+    with threadpool_limits(limits=1):
+        return extract_features_from_path(file_path), label
+
+
 if __name__ == "__main__":
-    X = []
-    y = []
-
-    for label in ["bad", "normal", "good"]:
-        class_dir = os.path.join(dataset_root, label)
-        for file in os.listdir(class_dir):
-            if file.endswith(".wav"):
-                file_path = os.path.join(class_dir, file)
-                features = extract_features(file_path)
-                X.append(features)
-                y.append(label)
-
-    X = np.array(X)
-    y = np.array(y)
+    os.environ["OPENBLAS_NUM_THREADS"] = "1"
+
+    # reference the worker through the importable module (not __main__) so each
+    # loky worker keeps its own lazily loaded YAMNet across tasks
+    import audio_features
+
+    items = [
+        (os.path.join(dataset_root, label, file), label)
+        for label in ["bad", "normal", "good"]
+        for file in os.listdir(os.path.join(dataset_root, label))
+        if file.endswith(".wav")
+    ]
+    uses_cuda = default_device() == "cuda" or (TORCHAUDIO_AVAILABLE and torch.cuda.is_available())
+    n_jobs = GPU_N_JOBS if uses_cuda else os.cpu_count()
+    results = Parallel(n_jobs=n_jobs, backend="loky", return_as="generator")(
+        delayed(audio_features._process)(path, label) for path, label in items
+    )
+
+    # preallocated float32 matrix, filled as results stream back (half the RAM of float64)
+    X = None
+    y = np.empty(len(items), dtype=object)
+    for i, (features, label) in enumerate(results):
+        if X is None:
+            X = np.empty((len(items), len(features)), dtype=np.float32)
+        X[i] = features
+        y[i] = label
+    y = y.astype(str)
     np.save("X_audio.npy", X)
     np.save("y_audio.npy", y)
 
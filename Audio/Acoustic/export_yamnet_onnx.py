@@ -0,0 +1,27 @@
+import os
+import subprocess
+import sys
+import tensorflow_hub as hub
+from onnxruntime.quantization import QuantType, quantize_dynamic
+
+from audio_features import YAMNET_ONNX, YAMNET_URL
+
+# One-shot conversion: TF Hub SavedModel -> ONNX (fp32) -> ONNX with int8 weights.
+# audio_features.get_yamnet() only uses YAMNET_ONNX when YAMNET_USE_ONNX=1 is set.
+
+if __name__ == "__main__":
+    saved_model_dir = hub.resolve(YAMNET_URL)
+    fp32_path = YAMNET_ONNX.replace("_int8", "")
+
+    subprocess.run([
+        sys.executable, "-m", "tf2onnx.convert",
+        "--saved-model", saved_model_dir,
+        "--output", fp32_path,
+        "--opset", "13",
+    ], check=True)
+
+    # dynamic quantization: int8 weights, activations quantized on the fly (no calibration set needed)
+    quantize_dynamic(fp32_path, YAMNET_ONNX, weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+
+    print(f"✅ Quantized YAMNet saved to: {YAMNET_ONNX}")
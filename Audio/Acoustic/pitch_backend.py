@@ -0,0 +1,62 @@
+import os
+import librosa
+import numpy as np
+
+# Optional packages (best-effort)
+try:
+    import torch
+    import torchcrepe
+    CREPE_AVAILABLE = True
+except Exception:
+    CREPE_AVAILABLE = False
+
+# ====== PITCH SETTINGS ======
+PITCH_FMIN = 80          # Hz, speech f0 band shared by features + metrics
+PITCH_FMAX = 300         # (narrow band keeps the pyin Viterbi state space small)
+# librosa's pyin defaults: the grid the shipped classifier's pitch_std feature was trained on,
+# so it must not change without retraining confidence_model_xgb.pkl and the scaler
+PITCH_FRAME = 2048       # samples, pyin analysis window
+PITCH_HOP = 512          # samples
+PERIODICITY_THRESHOLD = 0.21
+# CREPE is opt-in (PITCH_USE_CREPE=1): its f0 and periodicity voicing differ from pyin's, and the
+# shipped classifier was trained on pyin pitch, so it stays on pyin until the model is retrained
+USE_CREPE = os.environ.get("PITCH_USE_CREPE") == "1"
+SILENCE_THRESHOLD = 1e-3  # sample peak amplitude treated as silence
+
+
+def default_device():
+    """CUDA when CREPE is enabled and torchcrepe can use it, otherwise None (pyin on CPU)."""
+    if USE_CREPE and CREPE_AVAILABLE and torch.cuda.is_available():
+        return "cuda"
+    return None
+
+
+def estimate_pitch(y, sr, fmin=PITCH_FMIN, fmax=PITCH_FMAX, device=None):
+    """
+    Frame-wise f0 estimate for a mono waveform.
+    Uses batched CREPE (tiny) on GPU when enabled (PITCH_USE_CREPE=1) and available, else librosa.pyin.
+    Returns (f0, voiced): f0 in Hz per frame, voiced a boolean mask.
+    """
+    n_frames = 1 + len(y) // PITCH_HOP
+    if len(y) == 0 or np.max(np.abs(y)) < SILENCE_THRESHOLD:
+        return np.zeros(n_frames), np.zeros(n_frames, dtype=bool)
+
+    device = device or default_device()
+
+    if device is not None:
+        audio = torch.from_numpy(np.ascontiguousarray(y, dtype=np.float32)).unsqueeze(0).to(device)
+        f0, periodicity = torchcrepe.predict(
+            audio, sr, PITCH_HOP, fmin, fmax,
+            model="tiny",
+            batch_size=2048,
+            device=device,
+            return_periodicity=True,
+        )
+        f0 = f0[0].cpu().numpy()
+        voiced = periodicity[0].cpu().numpy() > PERIODICITY_THRESHOLD
+        return f0, voiced
+
+    f0, voiced, _ = librosa.pyin(
+        y, fmin=fmin, fmax=fmax, sr=sr, frame_length=PITCH_FRAME, hop_length=PITCH_HOP
+    )
+    return np.nan_to_num(f0), voiced & ~np.isnan(f0)
@@ -1,41 +1,66 @@
 import os
+import shutil
 import librosa
 import soundfile as sf
+from concurrent.futures import ProcessPoolExecutor
 
 SOURCE_DATASET = r"C:\Users\chint\OneDrive\Desktop\Audio dataset\augmented"
 TARGET_DATASET = r"C:\Users\chint\OneDrive\Desktop\Audio dataset\segmented_5s"
 SEG_LENGTH = 5  # seconds
+TARGET_SR = 16000
 
-os.makedirs(TARGET_DATASET, exist_ok=True)
 
-for label in ["bad", "normal", "good"]:
-    src_dir = os.path.join(SOURCE_DATASET, label)
-    out_dir = os.path.join(TARGET_DATASET, label)
-    os.makedirs(out_dir, exist_ok=True)
+def segment_file(path, out_dir):
+    """Split one WAV into SEG_LENGTH-second 16 kHz mono chunks inside out_dir."""
+    file = os.path.basename(path)
+    y, sr = sf.read(path, dtype="float32", always_2d=False)
+    is_target_format = sr == TARGET_SR and y.ndim == 1
+    if y.ndim > 1:
+        y = y.mean(axis=1)
+    if sr != TARGET_SR:
+        y = librosa.resample(y, orig_sr=sr, target_sr=TARGET_SR)
+        sr = TARGET_SR
 
-    for file in os.listdir(src_dir):
-        if not file.endswith(".wav"):
-            continue
+    total_duration = len(y) / sr
 
-        path = os.path.join(src_dir, file)
-        y, sr = librosa.load(path, sr=16000)
+    # already a single 16 kHz mono chunk: copy the bytes instead of re-encoding
+    if is_target_format and sr * 2 <= len(y) <= sr * SEG_LENGTH:
+        shutil.copyfile(path, os.path.join(out_dir, f"{file.replace('.wav','')}_seg0.wav"))
+        return
 
-        total_duration = len(y) / sr
-        seg_id = 0
-        t = 0
+    seg_id = 0
+    t = 0
 
-        while t < total_duration:
-            start = int(t * sr)
-            end = int(min((t + SEG_LENGTH) * sr, len(y)))
-            segment = y[start:end]
+    while t < total_duration:
+        start = int(t * sr)
+        end = int(min((t + SEG_LENGTH) * sr, len(y)))
+        segment = y[start:end]
 
-            if len(segment) < sr * 2:
-                break  # skip tiny tail segments
+        if len(segment) < sr * 2:
+            break  # skip tiny tail segments
 
-            out_file = os.path.join(out_dir, f"{file.replace('.wav','')}_seg{seg_id}.wav")
-            sf.write(out_file, segment, sr)
+        out_file = os.path.join(out_dir, f"{file.replace('.wav','')}_seg{seg_id}.wav")
+        sf.write(out_file, segment, sr, subtype="PCM_16")
 
-            seg_id += 1
-            t += SEG_LENGTH
+        seg_id += 1
+        t += SEG_LENGTH
 
-print("✅ Dataset segmented into 5-second windows successfully.")
+
+if __name__ == "__main__":
+    os.makedirs(TARGET_DATASET, exist_ok=True)
+
+    jobs = []
+    for label in ["bad", "normal", "good"]:
+        src_dir = os.path.join(SOURCE_DATASET, label)
+        out_dir = os.path.join(TARGET_DATASET, label)
+        os.makedirs(out_dir, exist_ok=True)
+
+        for file in os.listdir(src_dir):
+            if file.endswith(".wav"):
+                jobs.append((os.path.join(src_dir, file), out_dir))
+
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as pool:
+        # list() re-raises any worker exception here
+        list(pool.map(segment_file, [path for path, _ in jobs], [out for _, out in jobs]))
+
+    print("✅ Dataset segmented into 5-second windows successfully.")
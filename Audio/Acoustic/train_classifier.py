@@ -30,11 +30,22 @@ model = xgb.XGBClassifier(
     max_depth=6,
     subsample=0.9,
     colsample_bytree=0.9,
-    eval_metric="mlogloss"
+    eval_metric="mlogloss",
+    tree_method="hist",
+    # GPU training when this XGBoost build has CUDA support
+    device="cuda" if xgb.build_info().get("USE_CUDA") else "cpu",
+    n_jobs=-1
 )
 
-# Train
-model.fit(X_train, y_train)
+# Train (a CUDA build on a machine without a usable GPU falls back to CPU)
+try:
+    model.fit(X_train, y_train)
+except xgb.core.XGBoostError:
+    model.set_params(device="cpu")
+    model.fit(X_train, y_train)
+
+# The saved model is served on CPU by analyze_audio_final
+model.set_params(device="cpu")
 
 # Evaluate
 y_pred = model.predict(X_test)
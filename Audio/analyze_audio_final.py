@@ -1,11 +1,21 @@
 import os
 import json
+import hashlib
+import time
 import librosa
 import numpy as np
+import torch
 import whisper
 import joblib
 import re
-import soundfile as sf
+from numba import njit
+
+# Optional packages (best-effort)
+try:
+    from faster_whisper import WhisperModel
+    FASTER_WHISPER_AVAILABLE = True
+except Exception:
+    FASTER_WHISPER_AVAILABLE = False
 
 # ====== MODEL PATHS ======
 CLASSIFIER_MODEL = r"C:\Users\chint\OneDrive\Desktop\Public Speaking AI\Audio\Acoustic\confidence_model_xgb.pkl"
@@ -14,70 +24,219 @@ ENCODER_MODEL = r"C:\Users\chint\OneDrive\Desktop\Public Speaking AI\Audio\Acous
 
 # ====== FILLER WORDS ======
 FILLERS = {"um", "uh", "like", "basically", "you know", "so", "actually", "right"}
+# longest first so multi-word fillers ("you know") win over their prefixes
+_FILLER_RE = re.compile(r"\b(?:" + "|".join(map(re.escape, sorted(FILLERS, key=len, reverse=True))) + r")\b")
 
 # ====== LOAD CLASSIFIER ======
 clf = joblib.load(CLASSIFIER_MODEL)
 scaler = joblib.load(SCALER_MODEL)
-encoder = joblib.load(ENCODER_MODEL)
+# only the class names are needed at inference; keep them as plain str and drop the encoder
+_CLASSES = tuple(str(c) for c in joblib.load(ENCODER_MODEL).classes_)
+
+# ====== WHISPER (loaded once per process) ======
+WHISPER_MODEL = "small"
+_WHISPER = None
+# transcripts keyed by audio content, so retried / repeated uploads skip ASR. They hold user speech,
+# so they live in a private per-user directory (override with WHISPER_CACHE_DIR) and are evicted
+# by age and count
+WHISPER_CACHE_DIR = os.environ.get("WHISPER_CACHE_DIR") or os.path.join(
+    os.path.expanduser("~"), ".cache", "public_speaking_ai", "whisper"
+)
+WHISPER_CACHE_MAX_AGE = 7 * 24 * 3600   # seconds
+WHISPER_CACHE_MAX_FILES = 256
+
+
+def _get_whisper():
+    global _WHISPER
+    if _WHISPER is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        if FASTER_WHISPER_AVAILABLE:
+            # CTranslate2 backend: int8 on CPU, fp16 on GPU
+            compute_type = "float16" if device == "cuda" else "int8"
+            _WHISPER = WhisperModel(WHISPER_MODEL, device=device, compute_type=compute_type)
+        else:
+            _WHISPER = whisper.load_model(WHISPER_MODEL, device=device)
+    return _WHISPER
+
 
 # ====== IMPORT FEATURE EXTRACTOR ======
-from Acoustic.audio_features import extract_features
+from Acoustic.audio_features import frame_features, window_features, window_view
+from Acoustic.pitch_backend import SILENCE_THRESHOLD
 
 
 # ---------------- FILLER COUNT ----------------
 def count_fillers(text):
-    text = re.sub(r"[^\w\s]", "", text.lower())
-    words = text.split()
-    return sum(w in FILLERS for w in words)
+    return len(_FILLER_RE.findall(text.lower()))
 
 
 # ---------------- PITCH + ENERGY ----------------
-def compute_pitch_energy(y_seg, sr):
-    f0, _, _ = librosa.pyin(y_seg, fmin=librosa.note_to_hz('C2'), fmax=librosa.note_to_hz('C7'))
-    f0 = f0[~np.isnan(f0)]
-    pitch_mean = np.mean(f0) if len(f0) > 0 else 0.0
-    pitch_std = np.std(f0) if len(f0) > 0 else 0.0
-
-    rms = librosa.feature.rms(y=y_seg)[0]
-    energy = rms / np.max(np.abs(rms)) if np.max(np.abs(rms)) != 0 else rms
-    return pitch_mean, pitch_std, np.mean(energy), np.std(energy)
+@njit(cache=True, fastmath=True)
+def _energy_stats(rms):
+    """One pass over rms -> (mean, std, max_abs); mean/std are of rms / max_abs."""
+    n = rms.shape[0]
+    if n == 0:
+        return 0.0, 0.0, 0.0
+    s = 0.0
+    sq = 0.0
+    m = 0.0
+    for i in range(n):
+        v = rms[i]
+        s += v
+        sq += v * v
+        a = abs(v)
+        if a > m:
+            m = a
+    mean = s / n
+    var = max(sq / n - mean * mean, 0.0)
+    if m == 0.0:
+        return mean, np.sqrt(var), m
+    return mean / m, np.sqrt(var) / m, m
+
+
+@njit(cache=True, fastmath=False)  # fastmath would let the compiler drop the NaN check
+def _pitch_stats(pitch, voiced):
+    """(mean, std) of voiced, non-NaN pitch frames; (0, 0) when there are none."""
+    n = 0
+    s = 0.0
+    sq = 0.0
+    for i in range(pitch.shape[0]):
+        v = pitch[i]
+        if voiced[i] and not np.isnan(v):
+            n += 1
+            s += v
+            sq += v * v
+    if n == 0:
+        return 0.0, 0.0
+    mean = s / n
+    return mean, np.sqrt(max(sq / n - mean * mean, 0.0))
+
+
+def compute_pitch_energy(view, sample_peak):
+    """
+    Pitch / energy stats for one window_view of the whole-signal frame features.
+    sample_peak: max |y| over the window's own samples. Frames at the window edges overlap the
+    neighbouring windows, so silence is judged on the samples, not on the frame RMS.
+    """
+    if sample_peak < SILENCE_THRESHOLD:
+        return 0.0, 0.0, 0.0, 0.0  # silent window: nothing to normalize or track
+
+    energy_mean, energy_std, _ = _energy_stats(view["rms"])
+    pitch_mean, pitch_std = _pitch_stats(view["pitch"], view["voiced"])
+    return pitch_mean, pitch_std, energy_mean, energy_std
 
 
 # ---------------- CLASSIFIER ----------------
-def predict_quality_with_confidence(file_path):
-    feature_vector = extract_features(file_path)
-    x_scaled = scaler.transform([feature_vector])
+def predict_quality_with_confidence(feature_matrix):
+    """Score all rows of an (N, D) feature matrix in one batch -> [(label, probs), ...]."""
+    x_scaled = scaler.transform(feature_matrix)
 
-    pred_idx = clf.predict(x_scaled)[0]
-    label = encoder.inverse_transform([pred_idx])[0]
+    # one tree traversal: the predicted label is just the argmax of the probabilities
+    prob_scores = clf.predict_proba(x_scaled)
+    labels = [_CLASSES[i] for i in prob_scores.argmax(axis=1)]
 
-    prob_scores = clf.predict_proba(x_scaled)[0]
-    class_names = encoder.inverse_transform(np.arange(len(prob_scores)))
-    prob_dict = {str(cls): float(prob_scores[i]) for i, cls in enumerate(class_names)}
-
-    return label, prob_dict
+    return [
+        (label, {cls: float(probs[i]) for i, cls in enumerate(_CLASSES)})
+        for label, probs in zip(labels, prob_scores)
+    ]
 
 
 # ---------------- TEXT ALIGNMENT ----------------
 def get_text_for_fixed_windows(whisper_segments, total_duration, window=5.0):
     """Assign each Whisper segment text to exactly one 5 s window."""
     num_windows = int(np.ceil(total_duration / window))
-    window_texts = [""] * num_windows
+    buckets = [[] for _ in range(num_windows)]
+    if not whisper_segments:
+        return [""] * num_windows
+
+    # window index of every segment midpoint at once; segments outside the audio are dropped
+    mids = np.fromiter(((seg["start"] + seg["end"]) / 2 for seg in whisper_segments),
+                       dtype=float, count=len(whisper_segments))
+    idx = np.floor_divide(mids, window).astype(int)
+
+    for i, seg in zip(idx.tolist(), whisper_segments):
+        if 0 <= i < num_windows:
+            buckets[i].append(seg["text"].strip())
+
+    return [" ".join(b) for b in buckets]
+
+
+# ---------------- ASR ----------------
+def _audio_digest(audio_path):
+    """SHA-256 of the file bytes, read in chunks."""
+    h = hashlib.sha256()
+    with open(audio_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _transcribe_uncached(audio_path):
+    model = _get_whisper()
+    if FASTER_WHISPER_AVAILABLE:
+        segments, _ = model.transcribe(audio_path)
+        segments = [{"start": s.start, "end": s.end, "text": s.text} for s in segments]
+        return {"text": "".join(s["text"] for s in segments), "segments": segments}
+    result = model.transcribe(audio_path, fp16=torch.cuda.is_available())
+    return {
+        "text": result["text"],
+        "segments": [{"start": s["start"], "end": s["end"], "text": s["text"]} for s in result["segments"]],
+    }
 
-    for seg in whisper_segments:
-        midpoint = (seg["start"] + seg["end"]) / 2
-        idx = int(midpoint // window)
-        if 0 <= idx < num_windows:
-            window_texts[idx] += " " + seg["text"].strip()
 
-    return window_texts
+def transcribe(audio_path):
+    """Whisper ASR -> {"text", "segments": [{"start", "end", "text"}, ...]} for either backend, cached by content."""
+    backend = "faster" if FASTER_WHISPER_AVAILABLE else "openai"
+    key = f"{backend}-{WHISPER_MODEL}-{_audio_digest(audio_path)}"
+    cache_path = os.path.join(WHISPER_CACHE_DIR, key + ".json")
+
+    try:
+        if time.time() - os.path.getmtime(cache_path) < WHISPER_CACHE_MAX_AGE:
+            with open(cache_path, "r", encoding="utf-8") as f:
+                cached = json.load(f)
+            print("[INFO] Using cached transcript")
+            return cached
+    except FileNotFoundError:  # not cached yet, or just evicted by a concurrent request
+        pass
+
+    result = _transcribe_uncached(audio_path)
+
+    os.makedirs(WHISPER_CACHE_DIR, mode=0o700, exist_ok=True)
+    os.chmod(WHISPER_CACHE_DIR, 0o700)  # also tighten a directory that already existed
+    tmp_path = cache_path + f".{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(result, f)
+    os.replace(tmp_path, cache_path)  # atomic, so concurrent requests never read a partial file
+    _prune_whisper_cache()
+    return result
+
+
+def _prune_whisper_cache():
+    """Drop transcripts older than WHISPER_CACHE_MAX_AGE, then the oldest beyond WHISPER_CACHE_MAX_FILES."""
+    entries = []
+    now = time.time()
+    for entry in os.scandir(WHISPER_CACHE_DIR):
+        if not entry.name.endswith(".json"):
+            continue
+        try:
+            mtime = entry.stat().st_mtime
+            if now - mtime >= WHISPER_CACHE_MAX_AGE:
+                os.remove(entry.path)
+            else:
+                entries.append((mtime, entry.path))
+        except FileNotFoundError:  # removed by a concurrent request
+            pass
+    entries.sort()
+    for _, path in entries[:max(0, len(entries) - WHISPER_CACHE_MAX_FILES)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
 
 
 # ---------------- MAIN ANALYSIS ----------------
 def analyze_audio(audio_path):
     print("\n[INFO] Running Whisper ASR...")
-    model = whisper.load_model("small")
-    result = model.transcribe(audio_path, fp16=False)
+    result = transcribe(audio_path)
     whisper_segments = result["segments"]
     transcript = result["text"].strip()
 
@@ -87,7 +246,11 @@ def analyze_audio(audio_path):
     window = 5.0
     window_texts = get_text_for_fixed_windows(whisper_segments, total_dur, window=window)
 
+    # framewise MFCC / RMS / pitch / YAMNet over the whole signal, sliced per window below
+    frames = frame_features(y, sr)
+
     segment_data = []
+    feature_rows = []
     overall_fillers = 0
     total_words = 0
     all_pitch = []
@@ -97,7 +260,7 @@ def analyze_audio(audio_path):
         t_start = i * window
         t_end = min((i + 1) * window, total_dur)
         s_i, e_i = int(t_start * sr), int(t_end * sr)
-        y_seg = y[s_i:e_i]
+        view = window_view(frames, s_i, e_i)
 
         word_count = len(text.split())
         total_words += word_count
@@ -107,14 +270,12 @@ def analyze_audio(audio_path):
         fillers = count_fillers(text)
         overall_fillers += fillers
 
-        pitch_mean, pitch_std, energy_mean, energy_std = compute_pitch_energy(y_seg, sr)
+        sample_peak = np.max(np.abs(y[s_i:e_i]))
+        pitch_mean, pitch_std, energy_mean, energy_std = compute_pitch_energy(view, sample_peak)
         all_pitch.append(pitch_mean)
         all_energy.append(energy_mean)
 
-        tmp_path = "temp_seg.wav"
-        sf.write(tmp_path, y_seg, sr)
-        seg_label, seg_probs = predict_quality_with_confidence(tmp_path)
-        os.remove(tmp_path)
+        feature_rows.append(window_features(view))
 
         segment_data.append({
             "start": round(t_start, 2),
@@ -125,17 +286,22 @@ def analyze_audio(audio_path):
             "pitch_mean": round(pitch_mean, 2),
             "pitch_std": round(pitch_std, 2),
             "energy_mean": round(energy_mean, 3),
-            "energy_std": round(energy_std, 3),
-            "speaking_quality": seg_label,
-            "quality_confidence": {k: float(v) for k, v in seg_probs.items()}
+            "energy_std": round(energy_std, 3)
         })
 
+    # ----- CLASSIFIER (all windows + whole file in one batch) -----
+    features = np.vstack(feature_rows + [window_features(frames)])
+    predictions = predict_quality_with_confidence(features)
+    for seg, (seg_label, seg_probs) in zip(segment_data, predictions):
+        seg["speaking_quality"] = seg_label
+        seg["quality_confidence"] = seg_probs
+
     # ----- OVERALL METRICS -----
     overall_wpm = round((total_words / total_dur) * 60, 2)
     avg_pitch = round(float(np.nanmean(all_pitch)), 2)
     avg_energy = round(float(np.nanmean(all_energy)), 3)
 
-    full_label, full_probs = predict_quality_with_confidence(audio_path)
+    full_label, full_probs = predictions[-1]
 
     output = {
         "overall_speaking_quality": full_label,
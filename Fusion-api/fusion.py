@@ -1,11 +1,22 @@
-from fastapi import FastAPI, UploadFile, File
+from fastapi import FastAPI, Request, UploadFile, File
 from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager
 import httpx
+import aiofiles
 from pathlib import Path
-import shutil
 import asyncio
 
-app = FastAPI(title="Unified Public Speaking Analyzer")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # one pooled client for the app's lifetime: keep-alive connections to both backends
+    limits = httpx.Limits(max_keepalive_connections=32)
+    async with httpx.AsyncClient(timeout=None, limits=limits) as client:
+        app.state.client = client
+        yield
+
+
+app = FastAPI(title="Unified Public Speaking Analyzer", lifespan=lifespan)
 
 UPLOAD_DIR = Path("uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
@@ -14,18 +25,20 @@ AUDIO_API = "http://127.0.0.1:8080/analyze-audio"
 VIDEO_API = "http://127.0.0.1:8002/analyze/"
 
 @app.post("/analyze/")
-async def analyze_combined(file: UploadFile = File(...)):
+async def analyze_combined(request: Request, file: UploadFile = File(...)):
     try:
-        # 1️⃣ Save the uploaded video file locally
+        # 1️⃣ Read the upload once and keep a local copy without blocking the event loop
+        data = await file.read()
         file_path = UPLOAD_DIR / file.filename
-        with open(file_path, "wb") as f:
-            shutil.copyfileobj(file.file, f)
+        async with aiofiles.open(file_path, "wb") as f:
+            await f.write(data)
 
-        # 2️⃣ Run both analyses concurrently
-        async with httpx.AsyncClient(timeout=None) as client:
-            audio_task = client.post(AUDIO_API, files={"file": open(file_path, "rb")})
-            video_task = client.post(VIDEO_API, files={"file": open(file_path, "rb")})
-            audio_resp, video_resp = await asyncio.gather(audio_task, video_task)
+        # 2️⃣ Run both analyses concurrently, sending the same in-memory buffer to each
+        upload = {"file": (file.filename, data, file.content_type)}
+        client = request.app.state.client
+        audio_task = client.post(AUDIO_API, files=upload)
+        video_task = client.post(VIDEO_API, files=upload)
+        audio_resp, video_resp = await asyncio.gather(audio_task, video_task)
 
         # 3️⃣ Parse responses
         audio_json = audio_resp.json()
@@ -43,3 +56,7 @@ async def analyze_combined(file: UploadFile = File(...)):
 
     except Exception as e:
         return JSONResponse(content={"status": "error", "message": str(e)})
+
+    finally:
+        # release the upload's spooled temp file as soon as we're done with it
+        await file.close()
@@ -1,6 +1,7 @@
 from fastapi import FastAPI, UploadFile, File
 from fastapi.responses import JSONResponse
-import shutil, os, uuid, json
+import asyncio, os, uuid, json
+import aiofiles
 from pathlib import Path
 from multimodal_pipeline import analyze_video  # your analysis function
 
@@ -19,13 +20,14 @@ async def analyze_endpoint(file: UploadFile = File(...)):
         # Save uploaded file
         file_id = uuid.uuid4().hex
         input_path = UPLOAD_DIR / f"{file_id}_{file.filename}"
-        with open(input_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        async with aiofiles.open(input_path, "wb") as buffer:
+            while chunk := await file.read(1 << 20):
+                await buffer.write(chunk)
 
         print(f"🔍 Running analysis on {input_path}")
 
-        # Run the actual model (this blocks until it's done)
-        json_path = analyze_video(str(input_path), model_path="pose_landmarker_full.task")
+        # Run the actual model in a worker thread so the event loop keeps serving requests
+        json_path = await asyncio.to_thread(analyze_video, str(input_path), model_path="pose_landmarker_lite.task")
 
         # Ensure JSON output exists
         if not json_path or not os.path.exists(json_path):
@@ -34,9 +36,9 @@ async def analyze_endpoint(file: UploadFile = File(...)):
                 "message": "❌ No JSON generated or file not found."
             })
 
-        # Read JSON content
+        # Read JSON Lines content (one record per 5-second interval)
         with open(json_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
+            data = [json.loads(line) for line in f if line.strip()]
 
         # Return analysis result directly
         return JSONResponse({
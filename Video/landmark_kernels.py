@@ -0,0 +1,108 @@
+import math
+import numpy as np
+from numba import njit
+
+# Per-frame heuristics on (n, 3) float32 landmark arrays (x, y, z normalized).
+# Compiled once and cached on disk, so each call is a few µs instead of dozens
+# of tiny numpy allocations.
+
+# ---------- FaceMesh indices ----------
+# callers gather these rows once per frame (lm[FACE_CUE_IDX]) and the kernels index the compact
+# array by position, instead of picking individual landmarks out of the full 478-point mesh
+FACE_CUE_IDX = np.array([
+    70, 300,      # inner brows L / R
+    159, 145,     # left eye top / bottom
+    386, 374,     # right eye top / bottom
+    61, 291,      # mouth corners L / R
+    13, 14,       # inner lip top / bottom
+], dtype=np.int32)
+INNER_BROW_L, INNER_BROW_R = 0, 1
+EYE_TOP_L, EYE_BOT_L = 2, 3
+EYE_TOP_R, EYE_BOT_R = 4, 5
+MOUTH_L, MOUTH_R = 6, 7
+MOUTH_TOP, MOUTH_BOT = 8, 9
+
+# eye corners used to level the face crop: left eye (33, 133), right eye (362, 263)
+EYE_ALIGN_IDX = np.array([33, 133, 362, 263], dtype=np.int32)
+
+# ---------- Pose indices ----------
+POSE_CUE_IDX = np.array([0, 11, 12], dtype=np.int32)  # nose, shoulders L / R
+NOSE, SHOULDER_L, SHOULDER_R = 0, 1, 2
+
+# emotion codes returned by heuristic_emotion_code
+EMOTION_LABELS = ("Smiling / Happy", "Nervous / Tense", "Excited / Nervous", "Neutral / Calm")
+
+
+@njit(cache=True, fastmath=True)
+def _dist2(lm, a, b):
+    dx = lm[a, 0] - lm[b, 0]
+    dy = lm[a, 1] - lm[b, 1]
+    return math.sqrt(dx * dx + dy * dy)
+
+
+@njit(cache=True, fastmath=True)
+def _dist3(lm, a, b):
+    dx = lm[a, 0] - lm[b, 0]
+    dy = lm[a, 1] - lm[b, 1]
+    dz = lm[a, 2] - lm[b, 2]
+    return math.sqrt(dx * dx + dy * dy + dz * dz)
+
+
+@njit(cache=True, fastmath=True)
+def _clip(v, lo, hi):
+    return min(max(v, lo), hi)
+
+
+@njit(cache=True, fastmath=True)
+def facemesh_aus(lm):
+    """
+    Heuristic AU approximations from the FACE_CUE_IDX rows of the FaceMesh landmarks -> (AU01, AU12, AU26).
+    - AU01 (Inner Brow Raiser) -> inner-brow to eye distance relative to eye height
+    - AU12 (Lip Corner Puller) -> mouth width vs corner lift
+    - AU26 (Jaw Drop / Mouth Open) -> mouth open ratio
+    """
+    eye_avg = (_dist2(lm, EYE_TOP_L, EYE_BOT_L) + _dist2(lm, EYE_TOP_R, EYE_BOT_R)) / 2.0
+
+    au01_l = _clip(_dist2(lm, INNER_BROW_L, EYE_TOP_L) / (eye_avg + 1e-6) - 1.0, 0.0, 2.0) / 2.0
+    au01_r = _clip(_dist2(lm, INNER_BROW_R, EYE_TOP_R) / (eye_avg + 1e-6) - 1.0, 0.0, 2.0) / 2.0
+    au01 = (au01_l + au01_r) / 2.0
+
+    mouth_w = _dist2(lm, MOUTH_L, MOUTH_R)
+    corner_l_vert = abs(lm[MOUTH_TOP, 1] - lm[MOUTH_L, 1])
+    corner_r_vert = abs(lm[MOUTH_TOP, 1] - lm[MOUTH_R, 1])
+    au12 = _clip(mouth_w * 2.0 - (corner_l_vert + corner_r_vert), 0.0, 1.5) / 1.5
+
+    mouth_ratio = _dist2(lm, MOUTH_TOP, MOUTH_BOT) / (mouth_w + 1e-6)
+    au26 = _clip((mouth_ratio - 0.05) * 3.0, 0.0, 1.0)
+
+    return au01, au12, au26
+
+
+@njit(cache=True, fastmath=True)
+def heuristic_emotion_code(lm, body_energy):
+    """Index into EMOTION_LABELS from the FACE_CUE_IDX landmark rows and body energy."""
+    mouth_w = _dist3(lm, MOUTH_L, MOUTH_R)
+    mouth_open = _dist3(lm, MOUTH_TOP, MOUTH_BOT)
+    eye_open_ratio = (_dist3(lm, EYE_TOP_L, EYE_BOT_L) + _dist3(lm, EYE_TOP_R, EYE_BOT_R)) / 2.0
+    brow_dist = (_dist3(lm, INNER_BROW_L, EYE_TOP_L) + _dist3(lm, INNER_BROW_R, EYE_TOP_R)) / 2.0
+    mouth_ratio = mouth_open / mouth_w if mouth_w > 0 else 0.0
+
+    if mouth_ratio > 0.35 and mouth_w > 0.18:
+        return 0
+    if brow_dist < 0.03 or eye_open_ratio < 0.02:
+        return 1
+    if body_energy > 0.5:
+        return 2
+    return 3
+
+
+@njit(cache=True, fastmath=True)
+def pose_cues(pose):
+    """(shoulder_tension, head_tilt_deg) from the POSE_CUE_IDX rows of the PoseLandmarker landmarks."""
+    sh_dist = _dist3(pose, SHOULDER_L, SHOULDER_R)
+    # narrower shoulder span -> higher tension
+    shoulder_tension = _clip((0.35 - sh_dist) / 0.25, 0.0, 1.0)
+    mid_x = (pose[SHOULDER_L, 0] + pose[SHOULDER_R, 0]) / 2.0
+    mid_y = (pose[SHOULDER_L, 1] + pose[SHOULDER_R, 1]) / 2.0
+    head_tilt_deg = math.degrees(math.atan2(pose[NOSE, 1] - mid_y, pose[NOSE, 0] - mid_x))
+    return shoulder_tension, head_tilt_deg
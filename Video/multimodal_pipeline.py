@@ -1,7 +1,102 @@
-def analyze_video(video_path: str, model_path: str = "pose_landmarker_full.task"):
+import functools
+import threading
+
+
+# ---------- Heavy detectors (loaded once per process) ----------
+# analyze_video runs once per upload, and the API server runs uploads in worker threads, so the
+# expensive models are shared across calls. Each comes with a lock: none of them is safe to call
+# from two threads at once. The MediaPipe graphs stay per-call, since they carry per-video state.
+
+@functools.lru_cache(maxsize=None)
+def _get_yolo(weights):
+    from ultralytics import YOLO
+    yolo = YOLO(weights)
+    # fold BN into conv once
+    yolo.fuse()
+    return yolo, threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def _get_fer():
+    from fer import FER
+    # faces are always passed in as pre-cropped rectangles, so FER's own MTCNN detector is never used
+    return FER(mtcnn=False), threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def _get_feat_detector():
+    from feat import Detector
+    # skip internal face detection, we pass crops
+    return Detector(face_detection=True, face_detection_backend="skip"), threading.Lock()
+
+
+@functools.lru_cache(maxsize=None)
+def _resolve_pose_model(model_path):
+    """
+    Pose .task path to load. Relative paths fall back to this module's folder, where the bundles live.
+    The lite model (~3x fewer FLOPs) is the default but is not checked in (see the README's Video
+    setup for the download); until it is there the full bundle is used, with a warning once per process.
+    An explicitly requested full model is always honoured.
+    """
+    import os
+    if not os.path.isabs(model_path) and not os.path.exists(model_path):
+        model_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), model_path)
+    if os.path.basename(model_path) == "pose_landmarker_lite.task" and not os.path.exists(model_path):
+        full_model_path = os.path.join(os.path.dirname(model_path), "pose_landmarker_full.task")
+        if os.path.exists(full_model_path):
+            print("⚠ pose_landmarker_lite.task not found, using pose_landmarker_full.task")
+            model_path = full_model_path
+    return model_path
+
+
+@functools.lru_cache(maxsize=4)
+def _load_model_buffer(path):
+    """.task bundle bytes, read from disk once per process (MediaPipe takes them as model_asset_buffer)."""
+    with open(path, "rb") as f:
+        return f.read()
+
+
+# ---------- Hardware video decode ----------
+class _NvdecReader:
+    """
+    cv2.cudacodec (NVDEC) reader exposing the grab()/retrieve()/release() subset of
+    cv2.VideoCapture that analyze_video uses; frames are downloaded as BGR numpy arrays.
+    """
+
+    def __init__(self, path):
+        import cv2
+        self._reader = cv2.cudacodec.createVideoReader(path)
+        self._reader.set(cv2.cudacodec.ColorFormat_BGR)
+
+    def grab(self):
+        return self._reader.grab()
+
+    def retrieve(self, image=None):
+        ret, gpu_frame = self._reader.retrieve()
+        if not ret:
+            return False, None
+        return True, gpu_frame.download(image) if image is not None else gpu_frame.download()
+
+    def release(self):
+        self._reader = None
+
+
+def _open_nvdec_reader(path):
+    """NVDEC reader when OpenCV has cudacodec and a CUDA device, else None (software VideoCapture)."""
+    import cv2
+    try:
+        if not hasattr(cv2, "cudacodec") or cv2.cuda.getCudaEnabledDeviceCount() == 0:
+            return None
+        return _NvdecReader(path)
+    except Exception:
+        return None  # codec / driver not supported by NVDEC
+
+
+def analyze_video(video_path: str, model_path: str = "pose_landmarker_lite.task", show_preview: bool = False):
     """
     Runs the multimodal analysis pipeline on a given video.
     Returns the path to the annotated output video and the CSV as a DataFrame.
+    show_preview: draw the overlays and show a live window (Esc stops early); off for server runs.
 
     """
     # (✅ Paste your existing code here)
@@ -18,17 +113,23 @@ def analyze_video(video_path: str, model_path: str = "pose_landmarker_full.task"
     """
 
     import os
+    import queue
     import cv2
     import numpy as np
-    import pandas as pd
+    import orjson
+    import polars as pl
     import mediapipe as mp
     from mediapipe.tasks import python
     from mediapipe.tasks.python import vision
-    from collections import deque
+    from landmark_kernels import (
+        EMOTION_LABELS, EYE_ALIGN_IDX, FACE_CUE_IDX, POSE_CUE_IDX,
+        facemesh_aus, heuristic_emotion_code, pose_cues,
+    )
 
     # Optional packages (best-effort)
     try:
         from ultralytics import YOLO
+        import torch
         ULTRALYTICS_AVAILABLE = True
     except Exception:
         ULTRALYTICS_AVAILABLE = False
@@ -47,12 +148,22 @@ def analyze_video(video_path: str, model_path: str = "pose_landmarker_full.task"
         FEAT_AVAILABLE = False
 
     # ---------- Settings ----------
-    model_path = r"pose_landmarker_full.task"
+    model_path = _resolve_pose_model(model_path)
     video_path = video_path
     yolo_candidates = ["yolov8m-face.pt", "yolov8n-face.pt"]
 
     FACE_CROP_SIZE = (256, 256)        # upscaled crop used for FaceMesh / FER
+    EMOTION_CROP_SIZE = (224, 224)     # aligned crop handed to the emotion detector
+    TARGET_FPS = 5.0                   # frames actually analysed per second (output is 5 s averages)
+    FACE_REDETECT_EVERY = 15           # analysed frames a tracked face box is trusted before re-detecting
+    DETECT_MAX_SIDE = 640              # px; face detectors run on a frame downscaled to this longest side
+    FACEMESH_REUSE_FRAMES = 4          # analysed frames FaceMesh landmarks may be reused for
+    FACEMESH_REUSE_IOU = 0.9           # ... while the face box overlaps the one they were measured on this much
+    NEAR_FACE_MIN_PX = 30              # hand-to-face "near" threshold: max(this, ratio * face width)
+    NEAR_FACE_RATIO = 0.6
+    FLOW_MAX_SPREAD = 4.0              # px; optical-flow disagreement that invalidates the tracked box
     FACE_LM_DRAW_STEP = 5
+    EMOTION_SMOOTH_WINDOW = 7          # analysed frames in the trailing emotion mode filter
 
     csv_path=os.path.splitext(video_path)[0] + "_5s_avg.csv"
     video_out = os.path.join(os.path.dirname(video_path), "output_enhanced_overlay.mp4")
@@ -70,51 +181,87 @@ def analyze_video(video_path: str, model_path: str = "pose_landmarker_full.task"
     def euclid_raw(p1, p2):
         return np.linalg.norm(np.array(p1) - np.array(p2))
 
-    def compute_motion_energy(prev_landmarks, curr_landmarks):
-        if not prev_landmarks or not curr_landmarks:
+    def landmarks_to_array(landmarks):
+        """(n, 3) float32 array of landmark x, y, z; None when there are no landmarks."""
+        if not landmarks:
+            return None
+        return np.fromiter(
+            (c for lm in landmarks for c in (lm.x, lm.y, lm.z)), dtype=np.float32, count=3 * len(landmarks)
+        ).reshape(-1, 3)
+
+    def rolling_mode(labels, window):
+        """
+        Most frequent label in each trailing `window` of labels (shorter at the start), in one pass:
+        cumulative one-hot counts give every window's histogram by subtraction. Ties go to the label
+        that sorts first.
+        """
+        if len(labels) == 0:
+            return labels
+        uniq, codes = np.unique(labels, return_inverse=True)
+        n = len(codes)
+        onehot = np.zeros((n + 1, len(uniq)), np.int32)
+        onehot[np.arange(1, n + 1), codes] = 1
+        cum = np.cumsum(onehot, axis=0)
+        counts = cum[1:] - cum[np.maximum(np.arange(1, n + 1) - window, 0)]
+        return uniq[counts.argmax(axis=1)]
+
+    def box_iou(a, b):
+        """Intersection-over-union of two (x1,y1,x2,y2) boxes."""
+        iw = min(a[2], b[2]) - max(a[0], b[0])
+        ih = min(a[3], b[3]) - max(a[1], b[1])
+        if iw <= 0 or ih <= 0:
             return 0.0
-        energy = 0.0
-        n = min(len(prev_landmarks), len(curr_landmarks))
-        for i in range(n):
-            a = prev_landmarks[i]
-            b = curr_landmarks[i]
-            energy += ((a.x - b.x)**2 + (a.y - b.y)**2 + (a.z - b.z)**2)**0.5
-        return energy / n if n>0 else 0.0
+        inter = iw * ih
+        union = (a[2]-a[0])*(a[3]-a[1]) + (b[2]-b[0])*(b[3]-b[1]) - inter
+        return inter / union if union > 0 else 0.0
+
+    def compute_motion_energies(pairs):
+        """
+        Mean per-landmark displacement for each (prev_arr, curr_arr) pair of (n, 3) arrays.
+        All pairs go through one concatenated norm + segmented sum; a pair with a missing side gives 0.
+        """
+        energies = [0.0] * len(pairs)
+        prev_parts, curr_parts, owners, starts = [], [], [], []
+        offset = 0
+        for k, (prev_arr, curr_arr) in enumerate(pairs):
+            if prev_arr is None or curr_arr is None:
+                continue
+            n = min(len(prev_arr), len(curr_arr))
+            if n == 0:
+                continue
+            prev_parts.append(prev_arr[:n])
+            curr_parts.append(curr_arr[:n])
+            owners.append(k)
+            starts.append(offset)
+            offset += n
+        if owners:
+            dist = np.linalg.norm(np.concatenate(prev_parts) - np.concatenate(curr_parts), axis=1)
+            sums = np.add.reduceat(dist, starts)
+            counts = np.diff(starts + [offset])
+            for k, total, n in zip(owners, sums, counts):
+                energies[k] = float(total / n)
+        return energies
 
     # ---------- Alignment ----------
     def align_face_image(face_crop_bgr, landmarks_norm):
         """
         Aligns face crop so eyes are horizontal.
-        - face_crop_bgr: original cropped BGR image (not upscaled)
-        - landmarks_norm: list of normalized landmarks relative to that crop (x,y in [0,1])
+        - face_crop_bgr: cropped image (any channel order; the pipeline passes the RGB crop)
+        - landmarks_norm: (n, 3) FaceMesh landmark array normalized to that crop (x,y in [0,1])
         If landmarks_norm are from the upscaled crop, ensure coordinates are normalized to crop.
-        Returns: rotated crop (BGR)
+        Returns: rotated crop (same channel order as the input)
         """
         try:
-            # landmarks_norm expected as list of objects or tuples (x,y)
-            # pick left/right eye landmark indices common to FaceMesh
-            left_eye_idx = [33, 133]   # approximate controllers for left eye region
-            right_eye_idx = [362, 263] # approximate controllers for right eye region
-
             h, w = face_crop_bgr.shape[:2]
-            def avg_point(idxs):
-                pts = []
-                for i in idxs:
-                    lm = landmarks_norm[i]
-                    # if lm has attributes x,y
-                    if hasattr(lm, "x"):
-                        pts.append([lm.x * w, lm.y * h])
-                    else:
-                        pts.append([lm[0] * w, lm[1] * h])
-                return np.mean(pts, axis=0)
-
-            l_eye = avg_point(left_eye_idx)
-            r_eye = avg_point(right_eye_idx)
+            # eye corners in pixels: rows 0-1 left eye, rows 2-3 right eye
+            eyes = landmarks_norm[EYE_ALIGN_IDX, :2] * np.array([w, h], dtype=np.float32)
+            l_eye = eyes[:2].mean(axis=0)
+            r_eye = eyes[2:].mean(axis=0)
             dx = r_eye[0] - l_eye[0]
             dy = r_eye[1] - l_eye[1]
-            angle = np.degrees(np.arctan2(dy, dx))
-            center = tuple(np.array([w/2, h/2]))
-            rot = cv2.getRotationMatrix2D(tuple(((l_eye+r_eye)/2)), angle, 1.0)
+            angle = float(np.degrees(np.arctan2(dy, dx)))
+            eye_mid = (l_eye + r_eye) / 2
+            rot = cv2.getRotationMatrix2D((float(eye_mid[0]), float(eye_mid[1])), angle, 1.0)
             aligned = cv2.warpAffine(face_crop_bgr, rot, (w, h), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
             return aligned
         except Exception:
@@ -124,22 +271,21 @@ def analyze_video(video_path: str, model_path: str = "pose_landmarker_full.task"
     feat_detector = None
     if FEAT_AVAILABLE:
         try:
-            # Detector is expensive to instantiate; reuse it
-            feat_detector = Detector(face_detection=True, face_detection_backend="skip")  # skip internal face detection, we pass crops
+            # Detector is expensive to instantiate; reuse it across calls
+            feat_detector, feat_lock = _get_feat_detector()
             print("✅ feat (py-feat) available")
         except Exception as e:
             FEAT_AVAILABLE = False
             feat_detector = None
             print("⚠️ feat init failed:", e)
 
-    def extract_aus_with_feat(face_bgr):
+    def extract_aus_with_feat(face_rgb):
         """Return a dict of AUs as provided by py-feat Detector (if available)"""
         if not FEAT_AVAILABLE or feat_detector is None:
             return None
         try:
-            # Detector expects RGB
-            rgb = cv2.cvtColor(face_bgr, cv2.COLOR_BGR2RGB)
-            res = feat_detector.detect_image(rgb)
+            with feat_lock:
+                res = feat_detector.detect_image(face_rgb)
             # res.emotions and res.aus available, take first row
             if res is None or res.shape[0] == 0:
                 return None
@@ -154,61 +300,15 @@ def analyze_video(video_path: str, model_path: str = "pose_landmarker_full.task"
             return None
 
     # ---------- Landmark-based AU heuristics (fallback) ----------
-    def extract_aus_from_facemesh(lm_list):
+    def extract_aus_from_facemesh(lm_arr):
         """
-        lm_list: list of normalized face landmarks (FaceMesh format relative to crop)
-        Returns a dict of heuristic AU approximations:
-        - AU01 (Inner Brow Raiser) -> relative distance between inner-brow and eye
-        - AU12 (Lip Corner Puller) -> mouth corner vs center
-        - AU26 (Jaw Drop / Mouth Open) -> mouth open ratio
-        Values are normalized approx in [0,1]
+        lm_arr: (n, 3) FaceMesh landmark array (normalized, relative to crop)
+        Returns a dict of heuristic AU approximations (AU01, AU12, AU26), approx in [0,1]
         """
-        if not lm_list:
+        if lm_arr is None:
             return {}
-        # helper to get point
-        def pt(i):
-            lm = lm_list[i]
-            return np.array([lm.x, lm.y])
-        # indices (FaceMesh common points)
-        # inner brows: 70(left inner brow), 300(right inner brow) - used in your code earlier
-        inner_brow_L = pt(70)
-        inner_brow_R = pt(300)
-        eye_top_L = pt(159); eye_bot_L = pt(145)
-        eye_top_R = pt(386); eye_bot_R = pt(374)
-        mouth_l = pt(61); mouth_r = pt(291)
-        mouth_top = pt(13); mouth_bot = pt(14)
-        jaw = pt(152)  # chin
-
-        # compute normalized distances
-        eye_l_height = np.linalg.norm(eye_top_L - eye_bot_L)
-        eye_r_height = np.linalg.norm(eye_top_R - eye_bot_R)
-        eye_avg = (eye_l_height + eye_r_height) / 2.0
-
-        # AU01: inner brow raise estimated by distance inner brow -> eye top
-        brow_l_dist = np.linalg.norm(inner_brow_L - eye_top_L)
-        brow_r_dist = np.linalg.norm(inner_brow_R - eye_top_R)
-        # normalize by eye height (heuristic)
-        au01_l = np.clip((brow_l_dist / (eye_avg + 1e-6)) - 1.0, 0.0, 2.0) / 2.0
-        au01_r = np.clip((brow_r_dist / (eye_avg + 1e-6)) - 1.0, 0.0, 2.0) / 2.0
-        AU01 = float((au01_l + au01_r) / 2.0)
-
-        # AU12: lip corner puller: horizontal distance of mouth corners relative to mouth width
-        mouth_w = np.linalg.norm(mouth_l - mouth_r)
-        # vertical distances of corners to top/bottom (indicating smile)
-        # use top vs corner vertical delta
-        mouth_center = (mouth_l + mouth_r) / 2.0
-        corner_l_vert = abs(mouth_top[1] - mouth_l[1])
-        corner_r_vert = abs(mouth_top[1] - mouth_r[1])
-        # bigger horizontal mouth width combined with corner up (smile) -> AU12
-        AU12 = float(np.clip((mouth_w * 2.0) - (corner_l_vert + corner_r_vert), 0.0, 1.5))
-        AU12 = AU12 / 1.5
-
-        # AU26 (jaw drop): mouth open ratio
-        mouth_open = np.linalg.norm(mouth_top - mouth_bot)
-        mouth_ratio = mouth_open / (mouth_w + 1e-6)
-        AU26 = float(np.clip((mouth_ratio - 0.05) * 3.0, 0.0, 1.0))
-
-        return {"AU01": AU01, "AU12": AU12, "AU26": AU26}
+        AU01, AU12, AU26 = facemesh_aus(lm_arr[FACE_CUE_IDX])
+        return {"AU01": float(AU01), "AU12": float(AU12), "AU26": float(AU26)}
 
     # ---------- Body language cues ----------
     def compute_body_cues(pose_landmarks, hand_landmarks, face_box):
@@ -266,18 +366,21 @@ def analyze_video(video_path: str, model_path: str = "pose_landmarker_full.task"
     fer_detector = None
     if FER_AVAILABLE:
         try:
-            fer_detector = FER(mtcnn=True)
+            fer_detector, fer_lock = _get_fer()
             print("✅ FER available")
         except Exception as e:
             FER_AVAILABLE = False
             fer_detector = None
             print("⚠️ FER init failed:", e)
 
-    def detect_emotion_deepface(face_crop_bgr):
+    def detect_emotion_deepface(face_crop_rgb):
         if FER_AVAILABLE and fer_detector is not None:
             try:
-                rgb = cv2.cvtColor(face_crop_bgr, cv2.COLOR_BGR2RGB)
-                res = fer_detector.detect_emotions(rgb)
+                # the input is already an aligned face crop: hand FER the whole image as the
+                # face box so it goes straight to the emotion CNN without running MTCNN
+                h, w = face_crop_rgb.shape[:2]
+                with fer_lock:
+                    res = fer_detector.detect_emotions(face_crop_rgb, face_rectangles=[(0, 0, w, h)])
                 if res:
                     emotions = res[0]["emotions"]
                     dominant = max(emotions, key=emotions.get)
@@ -297,8 +400,7 @@ def analyze_video(video_path: str, model_path: str = "pose_landmarker_full.task"
 
     # ✅ Create detector properly
     # Load model as bytes (recommended for Windows/MediaPipe)
-    with open(r"C:\Users\chint\OneDrive\Desktop\Public Speaking AI\Video\pose_landmarker_full.task", "rb") as f:
-        model_buffer = f.read()
+    model_buffer = _load_model_buffer(model_path)
 
     base_options = python.BaseOptions(model_asset_buffer=model_buffer)
     pose_options = vision.PoseLandmarkerOptions(
@@ -312,17 +414,21 @@ def analyze_video(video_path: str, model_path: str = "pose_landmarker_full.task"
 
     # Hands (MediaPipe Solutions)
     mp_hands = mp.solutions.hands
-    hands_detector = mp_hands.Hands(static_image_mode=False, max_num_hands=2)
+    # model_complexity=0: lite hand landmark model; only the index fingertip and coarse motion are used
+    hands_detector = mp_hands.Hands(static_image_mode=False, max_num_hands=2, model_complexity=0)
 
     # FaceMesh
     mp_face = mp.solutions.face_mesh
-    face_mesh = mp_face.FaceMesh(static_image_mode=True, max_num_faces=1, refine_landmarks=True, min_detection_confidence=0.4)
+    # video mode: the crop is always face-centred, so FaceMesh tracks landmarks from the previous
+    # call instead of re-running its face detector every frame
+    face_mesh = mp_face.FaceMesh(static_image_mode=False, max_num_faces=1, refine_landmarks=True, min_detection_confidence=0.4)
 
     # FaceDetection fallback
     face_detection = mp.solutions.face_detection.FaceDetection(model_selection=1, min_detection_confidence=0.35)
 
     # YOLO face detection (optional loader)
     yolo = None
+    yolo_device = "cpu"
     if ULTRALYTICS_AVAILABLE:
         sel = None
         for f in yolo_candidates:
@@ -330,8 +436,10 @@ def analyze_video(video_path: str, model_path: str = "pose_landmarker_full.task"
                 sel = f; break
         if sel:
             try:
-                yolo = YOLO(sel)
-                print(f"✅ YOLO loaded ({sel})")
+                yolo, yolo_lock = _get_yolo(sel)
+                # fp16 on CUDA when there is a GPU
+                yolo_device = 0 if torch.cuda.is_available() else "cpu"
+                print(f"✅ YOLO loaded ({sel}) on {'cuda' if yolo_device == 0 else 'cpu'}")
             except Exception as e:
                 print("⚠️ YOLO load failed:", e)
                 yolo = None
@@ -346,54 +454,126 @@ def analyze_video(video_path: str, model_path: str = "pose_landmarker_full.task"
     fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
     frame_w = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
     frame_h = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    # analyse every `stride`-th frame; the others are only grabbed (demuxed, not decoded)
+    stride = max(1, int(round(fps / TARGET_FPS)))
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    # decode on the GPU's NVDEC unit when available; cap stays open for the metadata above
+    reader = _open_nvdec_reader(video_path) or cap
+    if reader is not cap:
+        print("✅ Decoding with NVDEC")
+    # MediaPipe VIDEO-mode timestamps for every source frame, computed once (same formula as per-frame)
+    timestamps_ms = (np.arange(max(total_frames, 0)) / fps * 1000).astype(np.int64)
+    # face detection is O(pixels) and fine at 640 px; only the crop needs full resolution
+    detect_scale = min(1.0, DETECT_MAX_SIDE / max(frame_w, frame_h, 1))
+
+    # ---------- Timeline (one preallocated array per column) ----------
+    # sized from the container's frame count; grown by doubling if that turns out to be short
+    timeline_cap = -(-total_frames // stride) if total_frames > 0 else 1024
+    timeline = {
+        "frame": np.empty(timeline_cap, np.int64),
+        "time_sec": np.empty(timeline_cap, np.float64),
+        "emotion_smoothed": np.empty(timeline_cap, object),
+        "emotion_raw": np.empty(timeline_cap, object),
+        "emotion_score": np.empty(timeline_cap, np.float32),
+        "body_energy": np.empty(timeline_cap, np.float32),
+        "hand_energy": np.empty(timeline_cap, np.float32),
+        "face_energy": np.empty(timeline_cap, np.float32),
+        "sync_status": np.empty(timeline_cap, object),
+        "au_source": np.empty(timeline_cap, object),
+        "shoulder_tension": np.empty(timeline_cap, np.float32),
+        "head_tilt_deg": np.empty(timeline_cap, np.float32),
+        "hands_to_face_px": np.empty(timeline_cap, np.float32),
+        "hands_near_face": np.empty(timeline_cap, bool),
+    }
+    n_rows = 0
+
+    def resize_column(arr, size):
+        out = np.empty(size, arr.dtype)
+        out[:len(arr)] = arr
+        if arr.dtype.kind == "f":
+            out[len(arr):] = np.nan  # AU columns rely on NaN for frames without that AU
+        return out
 
     # ⚠️ Skip annotated video output
     out_writer = None
 
 
-    # ---------- Loop state ----------
-    prev_pose_landmarks = None
-    prev_hand_landmarks = None
-    prev_face_landmarks = None
-
-    timeline = []
-    frame_idx = 0
-
-    # smoothing for emotion
-    emotion_history = deque(maxlen=7)
-
-    print("🎬 Processing frames...")
-
-    while True:
-        ret, frame = cap.read()
-        if not ret:
-            break
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=frame_rgb)
-        timestamp_ms = int((frame_idx / fps) * 1000)
-
-        # ----- Pose detection -----
-        try:
-            pose_result = pose_detector.detect_for_video(mp_image, timestamp_ms)
-            curr_pose_landmarks = pose_result.pose_landmarks[0] if pose_result.pose_landmarks else None
-        except Exception:
-            curr_pose_landmarks = None
+    # ---------- Pipeline threads ----------
+    # decode -> frames_q -> detectors -> detections_q -> FaceMesh/AUs/emotion/timeline (main thread).
+    # Each MediaPipe graph is only ever touched by one thread (they are not thread-safe);
+    # the OpenCV / MediaPipe / torch calls release the GIL, so the stages overlap.
+    frames_q = queue.Queue(maxsize=4)
+    detections_q = queue.Queue(maxsize=4)
+    stop_event = threading.Event()
+    worker_errors = []
 
-        # ----- Hands detection -----
+    def put_or_stop(q, item):
+        """Blocking put that gives up once the pipeline is stopping."""
+        while not stop_event.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def get_or_stop(q):
+        """Blocking get that returns the None sentinel once the pipeline is stopping."""
+        while not stop_event.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return None
+
+    # decoded frames are written into a ring of reusable buffers instead of fresh arrays; a slot is
+    # only rewritten once every frame that could still be queued or in use downstream has moved on
+    ring_size = frames_q.maxsize + detections_q.maxsize + 3  # + one frame held by each stage
+    ring_bgr = [None] * ring_size
+    ring_rgb = [None] * ring_size
+
+    def decode_worker():
+        frame_idx = 0
+        slot = 0
         try:
-            hands_res = hands_detector.process(frame_rgb)
-            curr_hand_landmarks = hands_res.multi_hand_landmarks if hands_res and hands_res.multi_hand_landmarks else None
-        except Exception:
-            curr_hand_landmarks = None
+            while not stop_event.is_set():
+                if not reader.grab():
+                    break
+                if frame_idx % stride != 0:
+                    frame_idx += 1
+                    continue
+                # OpenCV reallocates (and returns) a new array if a slot is still empty or the wrong shape
+                ret, frame = reader.retrieve(ring_bgr[slot])
+                if not ret:
+                    break
+                frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=ring_rgb[slot])
+                ring_bgr[slot], ring_rgb[slot] = frame, frame_rgb
+                slot = (slot + 1) % ring_size
+                if not put_or_stop(frames_q, (frame_idx, frame, frame_rgb)):
+                    break
+                frame_idx += 1
+        except Exception as e:
+            worker_errors.append(e)
+        finally:
+            put_or_stop(frames_q, None)
+
+    def detect_face_box(frame, frame_rgb):
+        """YOLO -> FaceDetection fallback on a downscaled frame; returns full-resolution (x1,y1,x2,y2) or None."""
+        if detect_scale < 1.0:
+            small = cv2.resize(frame, None, fx=detect_scale, fy=detect_scale, interpolation=cv2.INTER_AREA)
+            small_rgb = None  # converted only if the fallback detector runs
+        else:
+            small, small_rgb = frame, frame_rgb
 
-        # ----- Face detection: YOLO -> FaceDetection fallback -----
         face_box = None
         if yolo is not None:
             try:
-                yres = yolo(frame, verbose=False)
+                with yolo_lock:
+                    yres = yolo(small, imgsz=DETECT_MAX_SIDE, verbose=False, device=yolo_device, half=yolo_device != "cpu")
                 boxes = []
                 if len(yres) > 0 and hasattr(yres[0], "boxes") and yres[0].boxes is not None:
-                    arr = yres[0].boxes.xyxy.cpu().numpy()
+                    arr = yres[0].boxes.xyxy.cpu().numpy() / detect_scale
                     for b in arr:
                         x1,y1,x2,y2 = map(int, b[:4])
                         if x2-x1 > 8 and y2-y1 > 8:
@@ -406,7 +586,10 @@ def analyze_video(video_path: str, model_path: str = "pose_landmarker_full.task"
 
         if face_box is None:
             try:
-                fd_res = face_detection.process(frame_rgb)
+                if small_rgb is None:
+                    small_rgb = cv2.cvtColor(small, cv2.COLOR_BGR2RGB)
+                # relative bbox: scale-independent, mapped straight onto the full frame below
+                fd_res = face_detection.process(small_rgb)
                 if fd_res.detections and len(fd_res.detections) > 0:
                     d = fd_res.detections[0]
                     bbox = d.location_data.relative_bounding_box
@@ -419,280 +602,432 @@ def analyze_video(video_path: str, model_path: str = "pose_landmarker_full.task"
                         face_box = (x1,y1,x2,y2)
             except Exception:
                 face_box = None
+        return face_box
+
+    def track_face_box(prev_gray, gray, box):
+        """
+        Shift the previous face box by the median optical flow of corners inside it.
+        Returns None when tracking is unreliable (few points, inconsistent motion), so the caller re-detects.
+        """
+        x1,y1,x2,y2 = box
+        try:
+            pts = cv2.goodFeaturesToTrack(prev_gray[y1:y2, x1:x2], maxCorners=20, qualityLevel=0.01, minDistance=5)
+            if pts is None or len(pts) < 5:
+                return None
+            pts = pts + np.array([x1, y1], dtype=np.float32)
+            nxt, status, _ = cv2.calcOpticalFlowPyrLK(prev_gray, gray, pts, None, winSize=(21, 21), maxLevel=3)
+            ok = status.ravel() == 1
+            if ok.sum() < 5:
+                return None
+            flow = (nxt - pts).reshape(-1, 2)[ok]
+            dx, dy = np.median(flow, axis=0)
+            if np.max(np.linalg.norm(flow - (dx, dy), axis=1)) > FLOW_MAX_SPREAD:
+                return None  # blur / large motion / occlusion
+        except cv2.error:
+            return None
+        h, w = gray.shape
+        x1 = max(int(round(x1 + dx)), 0); y1 = max(int(round(y1 + dy)), 0)
+        x2 = min(int(round(x2 + dx)), w); y2 = min(int(round(y2 + dy)), h)
+        if x2 - x1 <= 8 or y2 - y1 <= 8:
+            return None
+        return (x1,y1,x2,y2)
+
+    def inference_worker():
+        # face box tracking state: full detection only every FACE_REDETECT_EVERY frames or when flow fails
+        last_face_box = None
+        prev_gray = None
+        gray_bufs = [None, None]  # ping-pong: current frame and prev_gray
+        frames_since_detect = 0
+        try:
+            while True:
+                item = get_or_stop(frames_q)
+                if item is None:
+                    break
+                frame_idx, frame, frame_rgb = item
+                mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=frame_rgb)
+                # the container's frame count can be short; compute past its end
+                timestamp_ms = int(timestamps_ms[frame_idx]) if frame_idx < len(timestamps_ms) else int((frame_idx / fps) * 1000)
+
+                # ----- Pose detection -----
+                try:
+                    pose_result = pose_detector.detect_for_video(mp_image, timestamp_ms)
+                    curr_pose_landmarks = pose_result.pose_landmarks[0] if pose_result.pose_landmarks else None
+                except Exception:
+                    curr_pose_landmarks = None
 
-        face_landmarks_for_frame = None
-        face_crop_for_emotion = None
-        aus_dict = {}
-        au_source = "none"
-
-        if face_box is not None:
-            x1,y1,x2,y2 = face_box
-            crop = frame[y1:y2, x1:x2]
-            if crop.size != 0:
-                # upscale for FaceMesh / FER
-                crop_up = cv2.resize(crop, FACE_CROP_SIZE, interpolation=cv2.INTER_LINEAR)
-                crop_up_rgb = cv2.cvtColor(crop_up, cv2.COLOR_BGR2RGB)
-                # FaceMesh on upscaled crop
+                # ----- Hands detection -----
                 try:
-                    fm_res = face_mesh.process(crop_up_rgb)
-                    if fm_res.multi_face_landmarks and len(fm_res.multi_face_landmarks) > 0:
-                        lm_list = fm_res.multi_face_landmarks[0].landmark
-                        face_landmarks_for_frame = lm_list
-                        # remap lm coords to original frame scale when drawing (we'll draw from lm_list scaled back)
-                        # draw some landmarks on main frame
-                        for i, lm in enumerate(lm_list):
-                            if i % FACE_LM_DRAW_STEP != 0:
-                                continue
-                            cx = int(lm.x * (x2 - x1)) + x1
-                            cy = int(lm.y * (y2 - y1)) + y1
-                            cv2.circle(frame, (cx, cy), 1, (0,255,0), -1)
-                        cv2.rectangle(frame, (x1,y1), (x2,y2), (255,0,0), 2)
-                    else:
-                        face_landmarks_for_frame = None
+                    hands_res = hands_detector.process(frame_rgb)
+                    curr_hand_landmarks = hands_res.multi_hand_landmarks if hands_res and hands_res.multi_hand_landmarks else None
                 except Exception:
-                    face_landmarks_for_frame = None
+                    curr_hand_landmarks = None
 
-                # Align crop using FaceMesh landmarks if available (pass landmarks relative to upscaled crop)
-                aligned_crop = crop_up.copy()
-                if face_landmarks_for_frame:
-                    aligned_crop = align_face_image(crop_up, face_landmarks_for_frame)
+                # ----- Face box: optical-flow track, else YOLO -> FaceDetection fallback -----
+                gray = gray_bufs[0] = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=gray_bufs[0])
+                gray_bufs.reverse()
+                face_box = None
+                if last_face_box is not None and frames_since_detect < FACE_REDETECT_EVERY:
+                    face_box = track_face_box(prev_gray, gray, last_face_box)
+                if face_box is None:
+                    face_box = detect_face_box(frame, frame_rgb)
+                    frames_since_detect = 0
+                else:
+                    frames_since_detect += 1
+                last_face_box = face_box
+                prev_gray = gray
+
+                if not put_or_stop(detections_q, (frame_idx, frame, frame_rgb, curr_pose_landmarks, curr_hand_landmarks, face_box)):
+                    break
+        except Exception as e:
+            worker_errors.append(e)
+        finally:
+            put_or_stop(detections_q, None)
 
-                # Save a version for emotion detector (pixel-space)
-                face_crop_for_emotion = cv2.resize(aligned_crop, (224,224), interpolation=cv2.INTER_LINEAR)
+    # ---------- Loop state ----------
+    # previous analysed frame's landmarks as (n, 3) arrays, for the motion energies
+    prev_pose_arr = None
+    prev_hand_arr = None
+    prev_face_arr = None
+    last_face_energy = 0.0
+
+    # FaceMesh landmark cache (reused while the face box is stable)
+    last_mesh_arr = None
+    last_mesh_box = None
+    frames_since_facemesh = 0
+
+
+    # per-frame face crops are resized into these (only used within one main-loop iteration)
+    crop_up_buf = np.empty((FACE_CROP_SIZE[1], FACE_CROP_SIZE[0], 3), np.uint8)
+    emotion_buf = np.empty((EMOTION_CROP_SIZE[1], EMOTION_CROP_SIZE[0], 3), np.uint8)
+
+    print("🎬 Processing frames...")
 
-                # 1) Try py-feat for AUs (on aligned crop in BGR)
-                if FEAT_AVAILABLE:
-                    aus = extract_aus_with_feat(aligned_crop)
-                    if aus:
+    workers = [threading.Thread(target=decode_worker, daemon=True),
+               threading.Thread(target=inference_worker, daemon=True)]
+    for t in workers:
+        t.start()
+
+    try:
+        while True:
+            item = detections_q.get()
+            if item is None:
+                break
+            frame_idx, frame, frame_rgb, curr_pose_landmarks, curr_hand_landmarks, face_box = item
+
+            curr_face_arr = None
+            face_crop_for_emotion = None
+            aus_dict = {}
+            au_source = "none"
+            mesh_reused = False
+            mesh_gap = 1
+
+            if face_box is not None:
+                x1,y1,x2,y2 = face_box
+                # crop from the RGB frame the decoder already produced: FaceMesh, FER and py-feat all take RGB
+                crop_rgb = frame_rgb[y1:y2, x1:x2]
+                if crop_rgb.size != 0:
+                    # upscale for FaceMesh / FER
+                    crop_up_rgb = cv2.resize(crop_rgb, FACE_CROP_SIZE, dst=crop_up_buf, interpolation=cv2.INTER_LINEAR)
+
+                    # FaceMesh on upscaled crop, unless the box has barely moved since the last run: landmarks
+                    # are relative to the crop, so they carry over unchanged while the face stays in the box
+                    mesh_reused = (
+                        last_mesh_arr is not None
+                        and frames_since_facemesh < FACEMESH_REUSE_FRAMES
+                        and box_iou(face_box, last_mesh_box) > FACEMESH_REUSE_IOU
+                    )
+                    if mesh_reused:
+                        curr_face_arr = last_mesh_arr
+                        frames_since_facemesh += 1
+                    else:
+                        try:
+                            fm_res = face_mesh.process(crop_up_rgb)
+                            if fm_res.multi_face_landmarks and len(fm_res.multi_face_landmarks) > 0:
+                                curr_face_arr = landmarks_to_array(fm_res.multi_face_landmarks[0].landmark)
+                        except Exception:
+                            curr_face_arr = None
+                        mesh_gap = frames_since_facemesh + 1
+                        frames_since_facemesh = 0
+                        last_mesh_arr = curr_face_arr
+                        last_mesh_box = face_box
+
+                    if show_preview and curr_face_arr is not None:
+                        # draw some landmarks on main frame (mapped from crop-relative coords)
+                        for lx, ly in curr_face_arr[::FACE_LM_DRAW_STEP, :2]:
+                            cv2.circle(frame, (int(lx * (x2 - x1)) + x1, int(ly * (y2 - y1)) + y1), 1, (0,255,0), -1)
+                        cv2.rectangle(frame, (x1,y1), (x2,y2), (255,0,0), 2)
+
+                    # Align crop using FaceMesh landmarks if available (pass landmarks relative to upscaled crop)
+                    aligned_crop = crop_up_rgb
+                    if curr_face_arr is not None:
+                        aligned_crop = align_face_image(crop_up_rgb, curr_face_arr)
+
+                    # Save a version for emotion detector (pixel-space)
+                    face_crop_for_emotion = cv2.resize(aligned_crop, EMOTION_CROP_SIZE, dst=emotion_buf, interpolation=cv2.INTER_LINEAR)
+
+                    # 1) Try py-feat for AUs (on aligned RGB crop)
+                    if FEAT_AVAILABLE:
+                        aus = extract_aus_with_feat(aligned_crop)
+                        if aus:
+                            aus_dict = aus
+                            au_source = "feat"
+                    # 2) fallback to landmark-based AU heuristics
+                    if not aus_dict and curr_face_arr is not None:
+                        aus = extract_aus_from_facemesh(curr_face_arr)
                         aus_dict = aus
-                        au_source = "feat"
-                # 2) fallback to landmark-based AU heuristics
-                if not aus_dict and face_landmarks_for_frame:
-                    aus = extract_aus_from_facemesh(face_landmarks_for_frame)
-                    aus_dict = aus
-                    au_source = "landmark_heuristic"
-
-                # Draw AU values on frame
-                au_texts = []
-                for k,v in aus_dict.items():
-                    au_texts.append(f"{k}:{v:.2f}")
-                for i, t in enumerate(au_texts[:4]):
-                    cv2.putText(frame, t, (x1+5, y2 + 20 + i*18), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (200,200,255), 1)
-
-        # ---- compute energies ----
-        body_energy = compute_motion_energy(prev_pose_landmarks, curr_pose_landmarks) if curr_pose_landmarks else 0.0
-        hand_energy = 0.0
-        if prev_hand_landmarks and curr_hand_landmarks:
-            prev_all = [lm for hand in prev_hand_landmarks for lm in hand.landmark]
-            curr_all = [lm for hand in curr_hand_landmarks for lm in hand.landmark]
-            hand_energy = compute_motion_energy(prev_all, curr_all)
-        face_energy = compute_motion_energy(prev_face_landmarks, face_landmarks_for_frame) if face_landmarks_for_frame else 0.0
-
-        # ---- body cues (expanded) ----
-        body_cues = {}
-        # compute shoulder tension & head tilt
-        try:
-            if curr_pose_landmarks:
-                left_sh = curr_pose_landmarks[11]; right_sh = curr_pose_landmarks[12]; nose = curr_pose_landmarks[0]
-                sh_dist = euclidean(left_sh, right_sh)
-                shoulder_tension = np.clip((0.35 - sh_dist) / 0.25, 0.0, 1.0)
-                mid_sh_x = (left_sh.x + right_sh.x) / 2.0
-                mid_sh_y = (left_sh.y + right_sh.y) / 2.0
-                v = np.array([nose.x - mid_sh_x, nose.y - mid_sh_y])
-                head_tilt_deg = float(np.degrees(np.arctan2(v[1], v[0])))
+                        au_source = "landmark_heuristic"
+
+                    # Draw AU values on frame
+                    if show_preview:
+                        au_texts = []
+                        for k,v in aus_dict.items():
+                            au_texts.append(f"{k}:{v:.2f}")
+                        for i, t in enumerate(au_texts[:4]):
+                            cv2.putText(frame, t, (x1+5, y2 + 20 + i*18), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (200,200,255), 1)
+
+            # ---- compute energies ----
+            curr_pose_arr = landmarks_to_array(curr_pose_landmarks)
+            curr_hand_arr = landmarks_to_array(
+                [lm for hand in curr_hand_landmarks for lm in hand.landmark] if curr_hand_landmarks else None
+            )
+            body_energy, hand_energy, face_energy = compute_motion_energies([
+                (prev_pose_arr, curr_pose_arr),
+                (prev_hand_arr, curr_hand_arr),
+                (None, None) if mesh_reused else (prev_face_arr, curr_face_arr),
+            ])
+            # prev_* are `stride` frames back: rescale to the per-frame motion the thresholds expect
+            body_energy /= stride
+            hand_energy /= stride
+            if mesh_reused:
+                face_energy = last_face_energy  # landmarks not re-measured: hold the last measured rate
+            else:
+                # prev_face_arr was measured mesh_gap analysed frames ago: spread the motion over them
+                face_energy /= stride * mesh_gap
+
+            # ---- body cues (expanded) ----
+            body_cues = {}
+            # compute shoulder tension & head tilt
+            if curr_pose_arr is not None:
+                shoulder_tension, head_tilt_deg = pose_cues(curr_pose_arr[POSE_CUE_IDX])
                 body_cues["shoulder_tension"] = float(shoulder_tension)
-                body_cues["head_tilt_deg"] = head_tilt_deg
+                body_cues["head_tilt_deg"] = float(head_tilt_deg)
             else:
                 body_cues["shoulder_tension"] = 0.0
                 body_cues["head_tilt_deg"] = 0.0
-        except Exception:
-            body_cues["shoulder_tension"] = 0.0
-            body_cues["head_tilt_deg"] = 0.0
-
-        # hands to face distance (pixel measure) & near-face flag
-        hands_to_face_min_px = None
-        hands_near_face_flag = False
-        if curr_hand_landmarks and face_box is not None:
-            x1,y1,x2,y2 = face_box
-            face_center = np.array([(x1+x2)/2.0, (y1+y2)/2.0])
-            hmin = 1e9
-            for hand in curr_hand_landmarks:
-                # mp hands landmark coordinates in Hands.process are normalized x,y relative to image width/height
-                # We'll convert to pixel coords
-                # If your hands detector was run on frame_rgb (full frame), these are normalized to full image.
-                h_px = np.array([hand.landmark[8].x * frame_w, hand.landmark[8].y * frame_h])  # index fingertip
-                d = np.linalg.norm(h_px - face_center)
-                if d < hmin: hmin = d
-                # near-face threshold (in pixels) heuristic: min(face_width, face_height) * 0.6
-            if hmin < 1e8:
-                hands_to_face_min_px = float(hmin)
-                face_w = x2 - x1
-                near_thresh = max(30, 0.6 * face_w)
-                hands_near_face_flag = hmin < near_thresh
-        body_cues["hands_to_face_px"] = float(hands_to_face_min_px) if hands_to_face_min_px is not None else None
-        body_cues["hands_near_face"] = bool(hands_near_face_flag)
-
-        # ---- detect emotion (separate) ----
-        # 1) try FER on aligned face crop if available
-        emotion_label = None
-        emotion_score = 0.0
-        if face_crop_for_emotion is not None:
-            lbl, sc = detect_emotion_deepface(face_crop_for_emotion)
-            if lbl is not None:
-                emotion_label = lbl
-                emotion_score = sc
-
-        # 2) fallback to your heuristic detect_emotion if FER not available or returned None
-        if emotion_label is None:
-            # reuse your detect_emotion but accept face_landmarks_for_frame in normalized form and body_energy
-            def heuristic_emotion(face_landmarks, body_energy):
-                if not face_landmarks:
-                    return "No Face"
-                # indices per FaceMesh
-                L_M, R_M = 61, 291
-                T_L, B_L = 13, 14
-                LE_T, LE_B = 159, 145
-                RE_T, RE_B = 386, 374
-                LB, RB = 70, 300
-                def dist_idx(a, b):
-                    return np.linalg.norm(np.array([a.x - b.x, a.y - b.y, a.z - b.z]))
-                mouth_w = dist_idx(face_landmarks[L_M], face_landmarks[R_M])
-                mouth_open = dist_idx(face_landmarks[T_L], face_landmarks[B_L])
-                eye_l = dist_idx(face_landmarks[LE_T], face_landmarks[LE_B])
-                eye_r = dist_idx(face_landmarks[RE_T], face_landmarks[RE_B])
-                brow_l = dist_idx(face_landmarks[LB], face_landmarks[LE_T])
-                brow_r = dist_idx(face_landmarks[RB], face_landmarks[RE_T])
-                mouth_ratio = (mouth_open / mouth_w) if mouth_w > 0 else 0
-                eye_open_ratio = (eye_l + eye_r) / 2
-                brow_dist = (brow_l + brow_r) / 2
-                if mouth_ratio > 0.35 and mouth_w > 0.18:
-                    return "Smiling / Happy"
-                if brow_dist < 0.03 or eye_open_ratio < 0.02:
-                    return "Nervous / Tense"
-                if body_energy > 0.5:
-                    return "Excited / Nervous"
-                return "Neutral / Calm"
-            emotion_label = heuristic_emotion(face_landmarks_for_frame, body_energy)
-
-        # smoothing emotion over recent frames for stability
-        emotion_history.append(emotion_label)
-        smoothed_emotion = max(set(emotion_history), key=emotion_history.count)
-
-        # ---- synchronization/generic overlay ----
-        energies = np.array([face_energy, hand_energy, body_energy], dtype=float)
-        sync_status = "No Movement"
-        if np.max(energies) > 0:
-            nrg = energies / (np.max(energies) + 1e-9)
-            sync_status = "In Sync" if np.std(nrg) < 0.25 else "Out of Sync"
-
-        # ---- Compose overlay text & color map ----
-        color_map = {
-            "Smiling / Happy": (0,255,0),
-            "Neutral / Calm": (200,200,0),
-            "Nervous / Tense": (0,0,255),
-            "Excited / Nervous": (0,128,255)
-        }
-        base_color = color_map.get(smoothed_emotion, (255,255,255))
-        info_text = f"F:{frame_idx} {smoothed_emotion} | Sync:{sync_status}"
-        cv2.putText(frame, info_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, base_color, 2)
-
-        # show body cues
-        cv2.putText(frame, f"BodyE:{body_energy:.3f} HandE:{hand_energy:.3f} FaceE:{face_energy:.3f}", (10,52), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (220,220,220), 1)
-        cv2.putText(frame, f"ShoulderT:{body_cues.get('shoulder_tension',0):.2f} HeadTilt:{body_cues.get('head_tilt_deg',0):.1f}", (10,70), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (220,220,220), 1)
-        if body_cues.get("hands_to_face_px") is not None:
-            cv2.putText(frame, f"Hand->Face(px):{body_cues['hands_to_face_px']:.0f} NearFace:{body_cues['hands_near_face']}", (10, 88), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (220,220,220), 1)
-
-        # Draw face box and AU summary
-        if face_box is not None:
-            x1,y1,x2,y2 = face_box
-            # small AU bar
-            xbar = x1; ybar = y1 - 60
-            if ybar < 0: ybar = y2 + 5
-            cv2.rectangle(frame, (xbar-2, ybar-2), (xbar+140, ybar+52), (30,30,30), -1)
-            idx = 0
-            for k,v in aus_dict.items():
-                cv2.putText(frame, f"{k}:{v:.2f}", (xbar+4, ybar+14 + idx*14), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (200,255,200), 1)
-                idx += 1
-
-        # Write frame to output
-        # out_writer.write(frame)
-
-        # Append timeline row
-        timeline.append({
-            "frame": frame_idx,
-            "time_sec": round(frame_idx / fps, 4),
-            "emotion_smoothed": smoothed_emotion,
-            "emotion_raw": emotion_label,
-            "emotion_score": float(emotion_score),
-            "body_energy": float(body_energy),
-            "hand_energy": float(hand_energy),
-            "face_energy": float(face_energy),
-            "sync_status": sync_status,
-            "au_source": au_source,
-            **{f"AU_{k}": float(v) for k,v in aus_dict.items()},
-            "shoulder_tension": float(body_cues.get("shoulder_tension", 0.0)),
-            "head_tilt_deg": float(body_cues.get("head_tilt_deg", 0.0)),
-            "hands_to_face_px": float(body_cues.get("hands_to_face_px", 0)) if body_cues.get("hands_to_face_px") is not None else None,
-            "hands_near_face": bool(body_cues.get("hands_near_face", False))
-        })
-
-        # update previous
-        prev_pose_landmarks = curr_pose_landmarks
-        prev_hand_landmarks = curr_hand_landmarks
-        prev_face_landmarks = face_landmarks_for_frame
-        frame_idx += 1
-
-        # live preview (optional)
-        cv2.imshow("Enhanced Pipeline", frame)
-        if cv2.waitKey(1) & 0xFF == 27:
-            print("User stopped early.")
-            break
-
-    # cleanup
-    cap.release()
-    cv2.destroyAllWindows()
+
+            # hands to face distance (pixel measure) & near-face flag
+            hands_to_face_min_px = None
+            hands_near_face_flag = False
+            if curr_hand_landmarks and face_box is not None:
+                x1,y1,x2,y2 = face_box
+                face_center = np.array([(x1+x2)/2.0, (y1+y2)/2.0])
+                hmin = 1e9
+                for hand in curr_hand_landmarks:
+                    # mp hands landmark coordinates in Hands.process are normalized x,y relative to image width/height
+                    # We'll convert to pixel coords
+                    # If your hands detector was run on frame_rgb (full frame), these are normalized to full image.
+                    h_px = np.array([hand.landmark[8].x * frame_w, hand.landmark[8].y * frame_h])  # index fingertip
+                    d = np.linalg.norm(h_px - face_center)
+                    if d < hmin: hmin = d
+                    # near-face threshold (in pixels) heuristic: min(face_width, face_height) * 0.6
+                if hmin < 1e8:
+                    hands_to_face_min_px = float(hmin)
+                    face_w = x2 - x1
+                    near_thresh = max(NEAR_FACE_MIN_PX, NEAR_FACE_RATIO * face_w)
+                    hands_near_face_flag = hmin < near_thresh
+            body_cues["hands_to_face_px"] = float(hands_to_face_min_px) if hands_to_face_min_px is not None else None
+            body_cues["hands_near_face"] = bool(hands_near_face_flag)
+
+            # ---- detect emotion (separate) ----
+            # 1) try FER on aligned face crop if available
+            emotion_label = None
+            emotion_score = 0.0
+            if face_crop_for_emotion is not None:
+                lbl, sc = detect_emotion_deepface(face_crop_for_emotion)
+                if lbl is not None:
+                    emotion_label = lbl
+                    emotion_score = sc
+
+            # 2) fallback to your heuristic detect_emotion if FER not available or returned None
+            if emotion_label is None:
+                # landmark geometry + body energy heuristic (compiled kernel)
+                if curr_face_arr is None:
+                    emotion_label = "No Face"
+                else:
+                    emotion_label = EMOTION_LABELS[heuristic_emotion_code(curr_face_arr[FACE_CUE_IDX], body_energy)]
+
+            # ---- synchronization/generic overlay ----
+            energies = np.array([face_energy, hand_energy, body_energy], dtype=float)
+            sync_status = "No Movement"
+            peak = energies.max()
+            if peak > 0:
+                nrg = energies / (peak + 1e-9)
+                sync_status = "In Sync" if np.std(nrg) < 0.25 else "Out of Sync"
+
+            if show_preview:
+                # ---- Compose overlay text & color map ----
+                color_map = {
+                    "Smiling / Happy": (0,255,0),
+                    "Neutral / Calm": (200,200,0),
+                    "Nervous / Tense": (0,0,255),
+                    "Excited / Nervous": (0,128,255)
+                }
+                # smoothing happens after the loop, so the live preview shows the raw label
+                base_color = color_map.get(emotion_label, (255,255,255))
+                info_text = f"F:{frame_idx} {emotion_label} | Sync:{sync_status}"
+                cv2.putText(frame, info_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 0.6, base_color, 2)
+
+                # show body cues
+                cv2.putText(frame, f"BodyE:{body_energy:.3f} HandE:{hand_energy:.3f} FaceE:{face_energy:.3f}", (10,52), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (220,220,220), 1)
+                cv2.putText(frame, f"ShoulderT:{body_cues.get('shoulder_tension',0):.2f} HeadTilt:{body_cues.get('head_tilt_deg',0):.1f}", (10,70), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (220,220,220), 1)
+                if body_cues.get("hands_to_face_px") is not None:
+                    cv2.putText(frame, f"Hand->Face(px):{body_cues['hands_to_face_px']:.0f} NearFace:{body_cues['hands_near_face']}", (10, 88), cv2.FONT_HERSHEY_SIMPLEX, 0.45, (220,220,220), 1)
+
+                # Draw face box and AU summary
+                if face_box is not None:
+                    x1,y1,x2,y2 = face_box
+                    # small AU bar
+                    xbar = x1; ybar = y1 - 60
+                    if ybar < 0: ybar = y2 + 5
+                    cv2.rectangle(frame, (xbar-2, ybar-2), (xbar+140, ybar+52), (30,30,30), -1)
+                    idx = 0
+                    for k,v in aus_dict.items():
+                        cv2.putText(frame, f"{k}:{v:.2f}", (xbar+4, ybar+14 + idx*14), cv2.FONT_HERSHEY_SIMPLEX, 0.4, (200,255,200), 1)
+                        idx += 1
+
+            # Write frame to output
+            # out_writer.write(frame)
+
+            # Append timeline row
+            if n_rows == timeline_cap:
+                timeline_cap *= 2
+                timeline = {k: resize_column(v, timeline_cap) for k, v in timeline.items()}
+            i = n_rows
+            timeline["frame"][i] = frame_idx
+            timeline["emotion_raw"][i] = emotion_label
+            timeline["emotion_score"][i] = emotion_score
+            timeline["body_energy"][i] = body_energy
+            timeline["hand_energy"][i] = hand_energy
+            timeline["face_energy"][i] = face_energy
+            timeline["sync_status"][i] = sync_status
+            timeline["au_source"][i] = au_source
+            for k, v in aus_dict.items():
+                col = f"AU_{k}"
+                if col not in timeline:
+                    timeline[col] = np.full(timeline_cap, np.nan, np.float32)
+                timeline[col][i] = v
+            timeline["shoulder_tension"][i] = body_cues.get("shoulder_tension", 0.0)
+            timeline["head_tilt_deg"][i] = body_cues.get("head_tilt_deg", 0.0)
+            hands_px = body_cues.get("hands_to_face_px")
+            timeline["hands_to_face_px"][i] = hands_px if hands_px is not None else np.nan
+            timeline["hands_near_face"][i] = body_cues.get("hands_near_face", False)
+            n_rows += 1
+
+            # update previous
+            prev_pose_arr = curr_pose_arr
+            prev_hand_arr = curr_hand_arr
+            prev_face_arr = curr_face_arr
+            last_face_energy = face_energy
+
+            # live preview (optional)
+            if show_preview:
+                cv2.imshow("Enhanced Pipeline", frame)
+                if cv2.waitKey(1) & 0xFF == 27:
+                    print("User stopped early.")
+                    break
+    finally:
+        # cleanup on every exit path (loop end, preview closed early, or an exception in the loop),
+        # so no worker stays blocked on a queue and no decoder / MediaPipe graph stays open in the server
+        stop_event.set()
+        for t in workers:
+            t.join()
+        if reader is not cap:
+            reader.release()
+        cap.release()
+        pose_detector.close()
+        hands_detector.close()
+        face_mesh.close()
+        if show_preview:
+            cv2.destroyAllWindows()
+
+    if worker_errors:
+        raise worker_errors[0]
 
     # Skip annotated video and per-frame CSV
     print("⚙️ Generating only 5-second aggregated CSV...")
 
-    # Create DataFrame from timeline (in-memory only)
-    df = pd.DataFrame(timeline)
+    # Fill the derived columns over the filled part of the timeline
+    timeline["time_sec"][:n_rows] = np.round(timeline["frame"][:n_rows] / fps, 4)  # one vectorized pass
+    # smoothing emotion over recent frames for stability
+    timeline["emotion_smoothed"][:n_rows] = rolling_mode(timeline["emotion_raw"][:n_rows], EMOTION_SMOOTH_WINDOW)
 
 
     # ---------- 5-second interval aggregation ----------
-    # ---------- 5-second interval aggregation ----------
+    if not n_rows:
+        print("⚠ No data for 5-sec aggregation.")
+        return None
+
+    categorical_cols = ["emotion_smoothed", "emotion_raw", "sync_status", "au_source", "hands_near_face"]
+    excluded = frozenset(categorical_cols) | {"interval", "frame", "time_sec"}
+    numeric_cols = [c for c in timeline if c not in excluded]
+
+    # interval keys, materialized once as int32 codes shared by every reduction below. Rows are in
+    # frame order, so each interval is one contiguous run: codes are a running count of run starts
+    # (no hashing or sorting), and intervals[code] maps them back to the 5 s labels
+    interval = (timeline["time_sec"][:n_rows] // 5).astype(np.int32) * 5
+    new_run = np.empty(n_rows, bool)
+    new_run[0] = True
+    np.not_equal(interval[1:], interval[:-1], out=new_run[1:])
+    starts = np.flatnonzero(new_run)
+    iv_codes = np.cumsum(new_run, dtype=np.int32) - 1
+    intervals = interval[starts]
+
+    # per-interval mode of each label column: integer-code it and count (interval, code) pairs into
+    # an (intervals x categories) matrix with one bincount; argmax takes the first maximum, so ties
+    # go to the smallest value, like series.mode().iloc[0]
+    def interval_mode(col):
+        cats, codes = np.unique(timeline[col][:n_rows], return_inverse=True)
+        counts = np.bincount(iv_codes * len(cats) + codes, minlength=len(intervals) * len(cats))
+        return cats[counts.reshape(len(intervals), len(cats)).argmax(axis=1)]
+
+    # per-interval means: a single reduceat over the interval runs of the stacked columns.
+    # NaNs (no AU / no hand) are left out of both sums and counts, like pandas' mean
+    # float32 throughout (sums, counts, quotient): half the bytes through the memory-bound
+    # reduction, and ample precision for 5 s averages of these metrics
+    values = np.column_stack([timeline[c][:n_rows] for c in numeric_cols]).astype(np.float32, copy=False)
+    valid = ~np.isnan(values)
+    with np.errstate(invalid="ignore"):
+        means = (np.add.reduceat(np.where(valid, values, np.float32(0)), starts, axis=0)
+                 / np.add.reduceat(valid, starts, axis=0, dtype=np.float32))
+
+    # intervals with no valid value for a metric come out of the division as NaN; store them as null so
+    # the CSV gets an empty cell and the JSON a null, as the pandas writers produced
+    grouped = pl.DataFrame({
+        "interval": intervals,
+        **{c: means[:, j] for j, c in enumerate(numeric_cols)},
+        **{c: interval_mode(c) for c in categorical_cols},
+    }).fill_nan(None)
+
+    # ---------- Save CSV ----------
+    # only the writes are guarded: a full disk or locked file loses that output, not the analysis
+    csv_path = os.path.splitext(video_path)[0] + "_5s_avg.csv"
     try:
-            if not df.empty and "time_sec" in df.columns:
-                df["interval"] = (df["time_sec"] // 5).astype(int) * 5
-
-                categorical_cols = ["emotion_smoothed", "emotion_raw", "sync_status", "au_source", "hands_near_face"]
-                numeric_cols = [c for c in df.columns if c not in categorical_cols + ["interval", "frame", "time_sec"]]
-
-                def mode_or_none(series):
-                    return series.mode().iloc[0] if not series.mode().empty else None
-
-                grouped = df.groupby("interval").agg({
-                    **{col: "mean" for col in numeric_cols},
-                    **{col: mode_or_none for col in categorical_cols}
-                }).reset_index()
-
-                # ---------- Save CSV ----------
-                csv_path = os.path.splitext(video_path)[0] + "_5s_avg.csv"
-                grouped.to_csv(csv_path, index=False)
-                print(f"✅ 5-sec aggregated CSV saved to: {csv_path}")
-
-                # ---------- Convert to JSON ----------
-                json_path = os.path.splitext(video_path)[0] + "_5s_avg.json"
-                grouped.to_json(json_path, orient="records", indent=2)
-                print(f"✅ JSON version saved to: {json_path}")
-
-            else:
-                print("⚠ No data for 5-sec aggregation.")
-                csv_path, json_path = None, None
-
-    except Exception as e:
-            print("⚠ Aggregation failed:", e)
-            csv_path, json_path = None, None
+        grouped.write_csv(csv_path)
+        print(f"✅ 5-sec aggregated CSV saved to: {csv_path}")
+    except (OSError, pl.exceptions.PolarsError) as e:
+        print("⚠ Could not save CSV:", e)
+        csv_path = None
+
+    # ---------- Convert to JSON ----------
+    # JSON Lines: one compact record per interval, streamed row by row through a 64 KB write buffer
+    json_path = os.path.splitext(video_path)[0] + "_5s_avg.jsonl"
+    try:
+        with open(json_path, "wb", buffering=65536) as f:
+            f.writelines(orjson.dumps(row, option=orjson.OPT_APPEND_NEWLINE)
+                         for row in grouped.iter_rows(named=True))
+        print(f"✅ JSON version saved to: {json_path}")
+    except (OSError, orjson.JSONEncodeError) as e:
+        print("⚠ Could not save JSON:", e)
+        json_path = None
 
-        # ✅ Return both file paths
     return json_path
\ No newline at end of file